@@ -0,0 +1,181 @@
+"""Choice and construction of the FAISS index type for the KB.
+
+Every kind uses inner product over L2-normalized vectors (cosine) and keeps
+the chunk ids as FAISS ids:
+
+- ``flat``: exact IndexFlatIP (wrapped in IndexIDMap2); best for small KBs.
+- ``ivf``: IndexIVFFlat, nlist ~ 4*sqrt(n) coarse clusters, ``nprobe`` of
+  them searched per query.
+- ``ivfpq``: IndexIVFPQ; vectors compressed to ~d/8 bytes (lossy; lower recall).
+- ``hnsw``: IndexHNSWFlat graph (wrapped in IndexIDMap2); fast and accurate,
+  but has no removal, so deleting chunks rebuilds it.
+- ``auto``: flat below KB_ANN_FLAT_MAX chunks, ivf below KB_ANN_PQ_MIN, ivfpq above.
+
+Builds add new vectors to whatever index exists; `needs_rebuild` /
+`rebuild` then move the vectors into the configured kind (training IVF on a
+random sample) when the kind, or the IVF list count for the current size,
+no longer fits. `configure` applies the search-time knobs after loading.
+"""
+import math, os
+from typing import Tuple
+
+import numpy as np
+
+KB_INDEX_TYPE = os.getenv("KB_INDEX_TYPE", "auto").lower()
+KB_ANN_FLAT_MAX = int(os.getenv("KB_ANN_FLAT_MAX", "50000"))
+KB_ANN_PQ_MIN = int(os.getenv("KB_ANN_PQ_MIN", "2000000"))
+KB_ANN_NPROBE = int(os.getenv("KB_ANN_NPROBE", "16"))
+KB_ANN_EF_SEARCH = int(os.getenv("KB_ANN_EF_SEARCH", "64"))
+KB_ANN_HNSW_M = int(os.getenv("KB_ANN_HNSW_M", "32"))
+KB_ANN_TRAIN_PER_LIST = int(os.getenv("KB_ANN_TRAIN_PER_LIST", "64"))
+
+KINDS = ("flat", "ivf", "ivfpq", "hnsw")
+
+
+def choose_kind(n: int, kind: str = KB_INDEX_TYPE) -> str:
+    """Index kind to use for n vectors under the configured policy."""
+    if kind in KINDS:
+        return kind
+    if kind != "auto":
+        print(f"[KB] Unknown KB_INDEX_TYPE {kind!r}; using auto", flush=True)
+    if n < KB_ANN_FLAT_MAX:
+        return "flat"
+    return "ivf" if n < KB_ANN_PQ_MIN else "ivfpq"
+
+
+def nlist_for(n: int) -> int:
+    # ~4*sqrt(n) lists, but at least 39 training points per centroid
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def index_kind(index) -> str:
+    import faiss
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def has_ids(index) -> bool:
+    """True for indexes that carry chunk ids (ID-mapped or IVF)."""
+    import faiss
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexIVF))
+
+
+def needs_rebuild(index, kind: str = KB_INDEX_TYPE) -> bool:
+    want = choose_kind(index.ntotal, kind)
+    have = index_kind(index)
+    if want != have:
+        return True
+    if have in ("ivf", "ivfpq"):
+        # retrain once the KB has grown (or shrunk) well past what the lists were sized for
+        import faiss
+        nlist, ideal = faiss.extract_index_ivf(index).nlist, nlist_for(index.ntotal)
+        return not (ideal / 2 <= nlist <= ideal * 2)
+    return False
+
+
+def vectors_and_ids(index) -> Tuple[np.ndarray, np.ndarray]:
+    """All (vectors, ids) stored in an index; IVF-PQ gives back approximations."""
+    import faiss
+    if isinstance(index, faiss.IndexIDMap):
+        ids = faiss.vector_to_array(index.id_map).astype("int64")
+        return faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal), ids
+    ivf = faiss.extract_index_ivf(index)
+    invlists = ivf.invlists
+    ids = np.concatenate([
+        faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+        for l in range(ivf.nlist) if invlists.list_size(l)
+    ] or [np.empty(0, dtype="int64")]).astype("int64")
+    ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return ivf.reconstruct_batch(ids), ids
+
+
+def new_index(kind: str, d: int, n: int):
+    """Empty index of the given kind for about n vectors of dimension d (IVF still untrained)."""
+    import faiss
+    if kind == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(d))
+    if kind == "hnsw":
+        return faiss.IndexIDMap2(faiss.IndexHNSWFlat(d, KB_ANN_HNSW_M, faiss.METRIC_INNER_PRODUCT))
+    nlist = nlist_for(n)
+    if kind == "ivf":
+        return faiss.IndexIVFFlat(faiss.IndexFlatIP(d), d, nlist, faiss.METRIC_INNER_PRODUCT)
+    # ivfpq: ~8 dims per 8-bit sub-quantizer (m must divide d)
+    m = max(k for k in range(1, max(1, d // 8) + 1) if d % k == 0)
+    train_n = min(n, KB_ANN_TRAIN_PER_LIST * nlist)
+    nbits = 8 if train_n >= 256 * 39 else max(1, min(8, int(math.log2(max(2, train_n // 39)))))
+    return faiss.IndexIVFPQ(faiss.IndexFlatIP(d), d, nlist, m, nbits, faiss.METRIC_INNER_PRODUCT)
+
+
+def build_index(kind: str, vectors: np.ndarray, ids: np.ndarray, seed: int = 1234):
+    """Index of the given kind holding vectors under ids, training on a random sample first."""
+    n, d = vectors.shape
+    index = new_index(kind, d, n)
+    if not index.is_trained:
+        import faiss
+        nlist = faiss.extract_index_ivf(index).nlist
+        sample = min(n, max(KB_ANN_TRAIN_PER_LIST * nlist, 39 * nlist))
+        rows = np.random.default_rng(seed).choice(n, sample, replace=False) if sample < n else slice(None)
+        index.train(np.ascontiguousarray(vectors[rows]))
+    index.add_with_ids(vectors, ids)
+    return configure(index)
+
+
+def rebuild(index, kind: str = KB_INDEX_TYPE):
+    """The vectors of index moved into the kind the policy picks for its size."""
+    want = choose_kind(index.ntotal, kind)
+    vectors, ids = vectors_and_ids(index)
+    if index_kind(index) == "ivfpq" and want != "ivfpq":
+        print("[KB] Note: converting from IVF-PQ keeps its compressed vectors; "
+              "run a full rebuild for exact ones", flush=True)
+    return build_index(want, vectors, ids)
+
+
+def remove_ids(index, ids):
+    """index without ids; HNSW has no removal, so it is rebuilt from the remaining vectors."""
+    ids = np.asarray(ids, dtype="int64")
+    if index_kind(index) != "hnsw":
+        index.remove_ids(ids)
+        return index
+    vectors, have = vectors_and_ids(index)
+    keep = ~np.isin(have, ids)
+    return build_index("hnsw", vectors[keep], have[keep])
+
+
+def configure(index):
+    """Apply the search-time knobs (nprobe / efSearch) to a loaded or new index.
+
+    IVF indexes also get an id -> list map, so `reconstruct` can fetch
+    candidate vectors by chunk id.
+    """
+    import faiss
+    kind = index_kind(index)
+    if kind in ("ivf", "ivfpq"):
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = KB_ANN_NPROBE
+        if ivf.direct_map.type != faiss.DirectMap.Hashtable:
+            ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    elif kind == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efSearch = KB_ANN_EF_SEARCH
+    return index
+
+
+def reconstruct(index, ids) -> np.ndarray:
+    """Stored vectors for chunk ids (approximate for IVF-PQ); every id must be in the index."""
+    return index.reconstruct_batch(np.asarray(ids, dtype="int64"))
+
+
+def describe(index) -> str:
+    import faiss
+    kind = index_kind(index)
+    if kind in ("ivf", "ivfpq"):
+        ivf = faiss.extract_index_ivf(index)
+        return f"{kind} (nlist={ivf.nlist}, nprobe={ivf.nprobe})"
+    if kind == "hnsw":
+        return f"hnsw (M={KB_ANN_HNSW_M}, efSearch={faiss.downcast_index(index.index).hnsw.efSearch})"
+    return kind
@@ -0,0 +1,135 @@
+"""In-memory vector index over saved Q&A pairs, used to answer repeated questions without the LLM.
+
+Rows come from the QADB `qa` table. Question vectors are kept in one
+normalized float32 matrix, so a lookup is a single matrix-vector product.
+The initial load embeds every stored question through `embed_many` (batched
+under the provider's per-request limits), outside the lock; lookups meanwhile
+miss. A failed load is retried after LOAD_RETRY_S, not on every request.
+"""
+import threading, time
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embed_cache import normalize_text
+
+# (qa id, question, answer, created_at unix seconds)
+Row = Tuple[int, str, str, float]
+
+LOAD_RETRY_S = 300.0
+
+
+class SemanticAnswerCache:
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], Sequence[Sequence[float]]],
+        load_rows: Callable[[], Iterable[Row]],
+        threshold: float = 0.93,
+        ttl_s: float = 7 * 24 * 3600,
+        embed_many: Optional[Callable[[List[str]], Sequence[Sequence[float]]]] = None,
+    ):
+        self.embed_fn = embed_fn
+        self.embed_many = embed_many or embed_fn
+        self.load_rows = load_rows
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._loading = False
+        self._retry_at = 0.0
+        self._generation = 0  # bumped by invalidate(), so a load started before it is discarded
+        self._rows: List[Row] = []
+        self._keys = {}  # normalized question -> row position
+        self._mat = np.zeros((0, 0), dtype="float32")
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _vectors(self, texts: List[str], embed_fn=None) -> np.ndarray:
+        mat = np.asarray((embed_fn or self.embed_fn)(texts), dtype="float32")
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        return mat / np.maximum(norms, 1e-12)
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded or self._loading or time.time() < self._retry_at:
+                return
+            self._loading = True
+            generation = self._generation
+        try:
+            # latest answer wins for duplicate questions
+            by_key = {}
+            for row in self.load_rows():
+                by_key[normalize_text(row[1])] = row
+            rows = list(by_key.values())
+            mat = self._vectors([r[1] for r in rows], self.embed_many) if rows else np.zeros((0, 0), dtype="float32")
+        except Exception as e:
+            print(f"[WARNING] Answer cache load failed ({e}); retrying in {LOAD_RETRY_S:.0f}s", flush=True)
+            with self._lock:
+                self._loading = False
+                self._retry_at = time.time() + LOAD_RETRY_S
+            return
+        with self._lock:
+            self._loading = False
+            if generation != self._generation:
+                return
+            self._rows, self._keys, self._mat = rows, {k: i for i, k in enumerate(by_key)}, mat
+            self._loaded = True
+        print(f"[QADB] Answer cache loaded {len(rows)} questions", flush=True)
+
+    def lookup(self, question: str, not_before: float = 0.0) -> Optional[dict]:
+        """Best stored answer whose question is similar enough, fresh (TTL) and newer than `not_before`."""
+        self._ensure_loaded()
+        with self._lock:
+            empty = not self._rows
+        if empty:
+            self.stats["misses"] += 1
+            return None
+        # embed outside the lock so concurrent lookups don't queue on the API call
+        qv = self._vectors([question])[0]
+        with self._lock:
+            if not self._rows or qv.shape[0] != self._mat.shape[1]:
+                self.stats["misses"] += 1
+                return None
+            scores = self._mat @ qv
+            cutoff = max(not_before, time.time() - self.ttl_s)
+            for i in np.argsort(-scores)[:5]:
+                if scores[i] < self.threshold:
+                    break
+                qid, q, answer, created = self._rows[i]
+                if created >= cutoff:
+                    self.stats["hits"] += 1
+                    return {"id": qid, "question": q, "answer": answer, "score": float(scores[i])}
+            self.stats["misses"] += 1
+            return None
+
+    def add(self, qid: int, question: str, answer: str, created: Optional[float] = None):
+        """Keep the cache in sync with a new QADB row (replaces an existing identical question)."""
+        with self._lock:
+            if not self._loaded:
+                return  # picked up by the initial load
+            row = (qid, question, answer, created if created is not None else time.time())
+            key = normalize_text(question)
+            pos = self._keys.get(key)
+            if pos is not None:
+                self._rows[pos] = row
+                return
+        vec = self._vectors([question])
+        with self._lock:
+            if not self._loaded:
+                return
+            if key in self._keys:
+                self._rows[self._keys[key]] = row
+                return
+            if self._rows and vec.shape[1] != self._mat.shape[1]:
+                return
+            self._mat = vec if not self._rows else np.vstack([self._mat, vec])
+            self._keys[key] = len(self._rows)
+            self._rows.append(row)
+
+    def invalidate(self):
+        """Drop everything; the next lookup reloads from the QADB."""
+        with self._lock:
+            self._loaded = False
+            self._retry_at = 0.0
+            self._generation += 1
+            self._rows, self._keys = [], {}
+            self._mat = np.zeros((0, 0), dtype="float32")
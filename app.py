@@ -1,68 +1,44 @@
 from dotenv import load_dotenv
-from openai import OpenAI
-import json, os, random, requests, sqlite3, re
-from pypdf import PdfReader
-import gradio as gr
-import faiss, numpy as np
+from openai import OpenAI, AsyncOpenAI
+import asyncio, json, os, random, requests, re, threading, hashlib, itertools, time
+import numpy as np  # faiss, gradio and pypdf are imported where used: they dominate startup time
 from glob import glob
 from pathlib import Path
+from collections import defaultdict
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import asynccontextmanager
 # ---------- FastAPI ----------
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
+from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from embeddings import make_backend
+from embed_cache import EmbeddingCache
+from answer_cache import SemanticAnswerCache
+from qadb import QADBStore
 
 load_dotenv(override=True)
 
 # --- NEW HELPERS for non-md sources ---------------------------------
-from typing import Iterable, Optional, Sequence, Tuple
-try:
-    import nbformat  # for .ipynb
-except Exception:
-    nbformat = None
-
-def read_pdf_text(path: str) -> str:
-    try:
-        from pypdf import PdfReader
-        reader = PdfReader(path)
-        chunks = []
-        for p in reader.pages:
-            t = p.extract_text() or ""
-            if t.strip():
-                chunks.append(t)
-        return "\n".join(chunks)
-    except Exception as e:
-        print(f"[KB] PDF read failed {path}: {e}")
-        return ""
-
-def read_ipynb_text(path: str) -> str:
-    if nbformat is None:
-        print("[KB] nbformat not installed; skipping .ipynb:", path)
-        return ""
-    try:
-        nb = nbformat.read(path, as_version=4)
-        parts = []
-        for cell in nb.cells:
-            if cell.cell_type == "markdown":
-                parts.append(cell.source)
-            elif cell.cell_type == "code":
-                # keep code lightly—useful for RAG but don’t over-index
-                parts.append("```code\n" + cell.source + "\n```")
-        return "\n\n".join(parts)
-    except Exception as e:
-        print(f"[KB] ipynb read failed {path}: {e}")
-        return ""
-
-def read_plain_text(path: str) -> str:
-    try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            return f.read()
-    except Exception as e:
-        print(f"[KB] text read failed {path}: {e}")
-        return ""
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+# readers live in kb_text so extraction worker processes can import them without this module
+from kb_text import extract, iter_extracted
+from text_cache import TextCache, file_key
+from kb_catalog import KBCatalog
+from context_budget import ContextAssembler, CONTEXT_ASSIGNMENT_TOKENS, count_tokens, truncate_to_tokens
+from chunk_store import ChunkStore, write_chunk_store
+import ann_index
+import metrics
+from kb_lexical import KBLexicalIndex
+from qadb import query_terms
+from dedup import KB_DEDUP, MinHashLSH
+from rag_pack import RAG_CONTEXT_TOKENS, mmr_order, pack
+
+KB_EXTS = (".md", ".txt", ".pdf", ".ipynb", ".r", ".rmd", ".py")
 
 def iter_kb_files() -> Iterable[str]:
     # extendable place to add patterns
-    exts = (".md", ".txt", ".pdf", ".ipynb", ".r", ".rmd", ".py")
+    exts = KB_EXTS
     # Try both relative and absolute paths
     kb_patterns = ["kb/**/*.*", os.path.join(os.getcwd(), "kb", "**", "*.*")]
     seen_files = set()  # Track files we've already yielded
@@ -79,74 +55,39 @@ def iter_kb_files() -> Iterable[str]:
 ASSIGNMENT_KEYWORDS = ("assignment", "project", "hw", "dama", "paltsokas")
 ASSIGNMENT_EXTS = (".pdf", ".md", ".txt", ".ipynb", ".r", ".rmd")
 
-def _looks_like_assignment(path: str) -> bool:
-    low = path.lower()
-    if not low.endswith(ASSIGNMENT_EXTS):
-        return False
-    return any(keyword in low for keyword in ASSIGNMENT_KEYWORDS)
-
-def _relative_to_kb(fp: str) -> str:
-    return os.path.relpath(fp, KB_DIR).replace("\\", "/")
-
-def _filter_candidates_by_folder(
-    candidates: Sequence[str],
-    folder: str,
-    allowed_exts: Optional[Sequence[str]],
-) -> list[str]:
-    norm = folder.strip().strip("/").replace("\\", "/")
-    exts = tuple(e.lower() for e in allowed_exts) if allowed_exts else None
-    out = []
-    for fp in candidates:
-        rel = _relative_to_kb(fp)
-        if norm and not rel.startswith(norm):
-            continue
-        if exts and not fp.lower().endswith(exts):
-            continue
-        out.append(fp)
-    return out
-
 def select_random_assignment(
     folder_filters: Optional[Sequence[str]] = None,
     allowed_exts: Optional[Sequence[str]] = None,
 ) -> Optional[Tuple[str, str]]:
     """Pick a random assignment-like file from the KB. Returns (display_name, relative_path)."""
-    all_files = list(iter_kb_files())
-    if not all_files:
-        return None
-
-    candidates: list[str] = []
-    if folder_filters:
-        for folder in folder_filters:
-            candidates = _filter_candidates_by_folder(all_files, folder, allowed_exts)
-            if candidates:
-                break
-    else:
-        exts = tuple(e.lower() for e in allowed_exts) if allowed_exts else None
-        candidates = [
-            fp for fp in all_files
-            if _looks_like_assignment(fp)
-            and (not exts or fp.lower().endswith(exts))
-        ]
-
-    if not candidates:
+    rel_path = KB_CATALOG.pick(folder_filters, allowed_exts)
+    if rel_path is None:
         return None
-
-    chosen = random.choice(candidates)
-    rel_path = _relative_to_kb(chosen)
-    raw_title = Path(chosen).stem
+    raw_title = Path(rel_path).stem
     display_name = re.sub(r"[_\\-]+", " ", raw_title).strip()
     if not display_name:
         display_name = rel_path
     return display_name, rel_path
 
+# extracted text per file version, shared by ingestion and assignment loading
+TEXT_CACHE = TextCache()
+
 def read_any_to_text(fp: str) -> str:
-    low = fp.lower()
-    if low.endswith(".pdf"):
-        return read_pdf_text(fp)
-    if low.endswith(".ipynb"):
-        return read_ipynb_text(fp)
-    # .md, .txt, .r, .rmd, .py → plain text
-    return read_plain_text(fp)
+    """Text of a KB file; each file version is parsed at most once (see text_cache)."""
+    try:
+        key = file_key(fp)
+    except OSError as e:
+        print(f"[KB] read failed {fp}: {e}", flush=True)
+        return ""
+    hit = TEXT_CACHE.get(key)
+    if hit is not None:
+        return hit[0]
+    res = extract(fp)
+    if res.error:
+        print(f"[KB] read failed {fp}: {res.error}", flush=True)
+        return ""
+    TEXT_CACHE.put(key, res.text, res.pages)
+    return res.text
 
 def load_assignment_context(rel_path: str, max_chars: int = 4000) -> Optional[str]:
     abs_path = os.path.join(KB_DIR, rel_path)
@@ -170,17 +111,42 @@ def load_assignment_context(rel_path: str, max_chars: int = 4000) -> Optional[st
 # Config / constants
 # =========================
 EMBEDDINGS_MODEL = os.getenv("EMBEDDINGS_MODEL", "text-embedding-3-small")
+# "openai" (EMBEDDINGS_MODEL via the API) or "hashing" (local, offline; see embeddings.py)
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "openai").lower()
 CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
 
 # RAG paths (use your repo's ./kb folder)
 KB_DIR = os.getenv("KB_DIR", "kb")
 KB_GLOB = os.getenv("KB_GLOB", f"{KB_DIR}/**/*.*")
+# built once here; picks for the "/kb/..." chips no longer walk the KB per request
+KB_CATALOG = KBCatalog(KB_DIR, KB_EXTS, ASSIGNMENT_KEYWORDS, ASSIGNMENT_EXTS)
 
 FAISS_DIR = "models/faiss"
 FAISS_INDEX = os.path.join(FAISS_DIR, "index.faiss")
-FAISS_STORE = os.path.join(FAISS_DIR, "store.jsonl")
+FAISS_STORE = os.path.join(FAISS_DIR, "chunks.bin")  # see chunk_store.py
+FAISS_STORE_JSONL = os.path.join(FAISS_DIR, "store.jsonl")  # pre-chunk-store format, migrated on load
+FAISS_MANIFEST = os.path.join(FAISS_DIR, "manifest.json")
+FAISS_LEXICAL = os.path.join(FAISS_DIR, "lexical.sqlite")  # BM25 over the same chunks, see kb_lexical.py
+FAISS_MINHASH = os.path.join(FAISS_DIR, "minhash.npz")  # signatures for near-duplicate detection, see dedup.py
+MANIFEST_VERSION = 1
+# serve the index and chunk texts from memory-mapped files (pages shared between
+# worker processes); off by default on Windows, where mapped files can't be replaced
+KB_INDEX_MMAP = os.getenv("KB_INDEX_MMAP", "0" if os.name == "nt" else "1") == "1"
+# new chunks are embedded in groups of this size while extraction carries on
+KB_EMBED_GROUP = int(os.getenv("KB_EMBED_GROUP", "512"))
+# hybrid retrieval: the query embedding may take this long before rag_search answers
+# from the lexical index alone; queries of at most RAG_KEYWORD_TERMS words
+# (e.g. "DAMA", a course code) skip the embedding when they match lexically
+RAG_EMBED_BUDGET_S = float(os.getenv("RAG_EMBED_BUDGET_S", "2.0"))
+RAG_KEYWORD_TERMS = int(os.getenv("RAG_KEYWORD_TERMS", "2"))
+RRF_K = 60  # reciprocal-rank fusion constant
+# fused candidates are reranked with MMR and packed (see rag_pack.py); passages from
+# assignment/PDF sources get this much extra relevance (on a 0-1 scale) as a tie-breaker
+RAG_SOURCE_BOOST = float(os.getenv("RAG_SOURCE_BOOST", "0.05"))
+RAG_BOOST_RE = re.compile(r"\.pdf|hw|assignment|dama", re.IGNORECASE)
 
 HELLO_THERE_RE = re.compile(r'^\s*[\W_]*hello\s+there[\W_]*\s*$', re.IGNORECASE)
+HELLO_THERE_REPLY = "General Kenoooobiiii... I mean... Hi! How are you? 😊"
 
 # =========================
 # Notifications (Pushover)
@@ -265,11 +231,25 @@ def set_client(c: OpenAI):
     global CLIENT
     CLIENT = c
 
+# builds the KB index and embeds queries; its name is recorded in the manifest
+EMBEDDER = make_backend(EMBEDDINGS_BACKEND, EMBEDDINGS_MODEL, lambda: CLIENT)
+
+# query embeddings only; index builds go through EMBEDDER.iter_batches
+EMBED_CACHE = EmbeddingCache()
+metrics.CallbackMetric("virtualme_embedding_cache", "Query embedding cache lookups.", ["result"],
+                       lambda: {("mem_hit",): EMBED_CACHE.stats["mem_hits"], ("disk_hit",): EMBED_CACHE.stats["disk_hits"],
+                                ("miss",): EMBED_CACHE.stats["misses"]})
+
 def embed_texts(texts):
-    if CLIENT is None:
-        raise RuntimeError("OpenAI client not set. Call set_client(me.openai) at startup.")
-    resp = CLIENT.embeddings.create(model=EMBEDDINGS_MODEL, input=texts)
-    return [d.embedding for d in resp.data]
+    if EMBEDDER.local:
+        return list(EMBEDDER.embed(list(texts)))
+    return EMBED_CACHE.embed(EMBEDDER.name, list(texts), EMBEDDER.embed)
+
+def embed_many(texts) -> np.ndarray:
+    """Vectors for many texts (one matrix), in batches under the provider's per-request limits."""
+    texts = list(texts)
+    parts = sorted(EMBEDDER.iter_batches(texts), key=lambda p: p[0])
+    return np.vstack([mat for _, mat in parts]) if parts else np.zeros((0, 0), dtype="float32")
 
 def _split_md(text: str, max_chars: int = 1200):
     parts, buf, count = [], [], 0
@@ -282,114 +262,582 @@ def _split_md(text: str, max_chars: int = 1200):
     if buf: parts.append("".join(buf).strip())
     return [p for p in parts if p]
 
-def build_faiss_index():
-    """Index md/txt/pdf/ipynb/R files under kb/ into FAISS."""
+def _file_sha256(fp: str) -> str:
+    h = hashlib.sha256()
+    with open(fp, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _chunk_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _load_manifest():
+    """Manifest of indexed files: {rel_path: {size, mtime, sha256, chunk_ids, chunk_hashes}}."""
+    try:
+        with open(FAISS_MANIFEST, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("embeddings_model") != EMBEDDER.name:
+        return None
+    return manifest
+
+def _index_embedder() -> Optional[str]:
+    """Embedding backend recorded for the index on disk (None for indexes built before manifests)."""
+    try:
+        with open(FAISS_MANIFEST, "r", encoding="utf-8") as f:
+            return json.load(f).get("embeddings_model")
+    except (OSError, ValueError):
+        return None
+
+def _write_manifest(files: dict, next_id: int):
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "embeddings_model": EMBEDDER.name,
+        "next_id": next_id,
+        "files": files,
+    }
+    with open(FAISS_MANIFEST + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(FAISS_MANIFEST + ".tmp", FAISS_MANIFEST)
+
+_BUILD_LOCK = threading.Lock()  # startup warm-up and manual rebuilds must not interleave
+
+def _embed_into_index(state, texts, ids):
+    """Embed one group of new chunks and add them to state.index (created on first use)."""
+    import faiss
+    for start, mat in EMBEDDER.iter_batches(texts):
+        faiss.normalize_L2(mat)
+        if state.index is None:
+            state.index = faiss.IndexIDMap2(faiss.IndexFlatIP(mat.shape[1]))
+        state.index.add_with_ids(mat, ids[start:start + len(mat)])
+        state.embedded += len(mat)
+        print(f"[KB] Embedded {state.embedded} chunks", flush=True)
+
+def _chunk_owners(files: dict) -> dict:
+    """chunk id -> files whose chunk_ids use it (near-duplicate chunks are shared)."""
+    owners = defaultdict(list)
+    for rel in sorted(files):
+        for cid in dict.fromkeys(files[rel]["chunk_ids"]):
+            owners[cid].append(rel)
+    return owners
+
+def _load_dedup(meta) -> MinHashLSH:
+    """LSH over the indexed chunks: saved signatures if they match the store, else computed from it."""
+    lsh = MinHashLSH()
+    if not isinstance(meta, ChunkStore) or not len(meta):
+        return lsh
+    try:
+        with np.load(FAISS_MINHASH) as saved:
+            if np.array_equal(np.sort(saved["ids"]), meta.ids):
+                lsh.load(saved["ids"], saved["sigs"])
+                return lsh
+    except (OSError, ValueError, KeyError):
+        pass
+    t0 = time.perf_counter()
+    lsh.load(meta.ids, lsh.signatures(chunk for _, chunk, _ in meta.rows()))
+    print(f"[KB] Computed MinHash signatures for {len(meta)} chunks in {time.perf_counter() - t0:.1f}s", flush=True)
+    _save_dedup(lsh, meta.ids)
+    return lsh
+
+def _save_dedup(lsh: MinHashLSH, live_ids):
+    ids, sigs = lsh.export(live_ids)
+    with open(FAISS_MINHASH + ".tmp", "wb") as f:
+        np.savez(f, ids=ids, sigs=sigs)
+    os.replace(FAISS_MINHASH + ".tmp", FAISS_MINHASH)
+
+def build_faiss_index(full: bool = False):
+    """Index md/txt/pdf/ipynb/R files under kb/ into FAISS.
+
+    Incremental by default: files whose size/mtime or content hash match the
+    manifest are skipped, only new or changed chunks are embedded, and chunks
+    of deleted files are removed from the ID-mapped index. ``full=True``
+    re-embeds everything.
+
+    Changed files are extracted in parallel (see kb_text.iter_extracted) and
+    their chunks are embedded while the remaining files are still being
+    extracted. A file whose extraction times out keeps its previous chunks.
+
+    With KB_DEDUP, a new chunk that is a near-duplicate (MinHash/LSH, see
+    dedup.py) of one already indexed from another file is not embedded again:
+    the file's manifest entry points at the existing chunk id, chunk ids are
+    removed once no file uses them, and the chunk store lists every file a
+    chunk appears in.
+
+    New vectors go into the existing index; the index type (KB_INDEX_TYPE,
+    see ann_index.py) is switched or retrained when the KB's size calls for it.
+    """
+    with _BUILD_LOCK:
+        return _build_faiss_index(full)
+
+def _build_faiss_index(full: bool):
+    import faiss
     os.makedirs(FAISS_DIR, exist_ok=True)
-    texts, meta = [], []
+    manifest = None if full else _load_manifest()
+    index, meta = (None, {})
+    if manifest is not None:
+        index, meta = _load_index(mmap=False)  # read fully: the build modifies it
+        if not ann_index.has_ids(index):
+            print("[KB] Manifest found but index is missing or not ID-mapped — full rebuild", flush=True)
+            manifest, index, meta = None, None, {}
+    old_files = manifest["files"] if manifest else {}
+    next_id = manifest["next_id"] if manifest else 0
+    lsh = _load_dedup(meta) if KB_DEDUP else None
+
+    files = {}
+    new_rows = []
     pdf_count = 0
     other_count = 0
+    unchanged = 0
+    deduped = 0
 
     print(f"[KB] Starting to index files from kb/ directory...", flush=True)
     all_files = list(iter_kb_files())
-    print(f"[KB] Found {len(all_files)} files to index", flush=True)
+    print(f"[KB] Found {len(all_files)} files in kb/", flush=True)
 
+    todo = {}  # fp -> (rel, stat, sha256, previous manifest entry)
     for fp in all_files:
-        print(f"[KB] Processing: {fp}", flush=True)
-        raw = read_any_to_text(fp)
-        if not raw.strip():
-            print(f"[KB] Warning: {fp} has no extractable text", flush=True)
+        rel = os.path.relpath(fp, "kb")
+        st = os.stat(fp)
+        prev = old_files.get(rel)
+        if prev and prev["size"] == st.st_size and prev["mtime"] == st.st_mtime_ns:
+            files[rel] = prev
+            unchanged += 1
             continue
-        
-        # Count PDFs vs other files
-        if fp.lower().endswith('.pdf'):
-            pdf_count += 1
-        else:
-            other_count += 1
-        
-        chunks = _split_md(raw)
-        print(f"[KB] Split {fp} into {len(chunks)} chunks", flush=True)
-        
-        for ch in chunks:
-            texts.append(ch)
-            meta.append({"source": os.path.relpath(fp, "kb")})
-
-    if not texts:
+        digest = _file_sha256(fp)
+        if prev and prev["sha256"] == digest:
+            files[rel] = {**prev, "size": st.st_size, "mtime": st.st_mtime_ns}
+            unchanged += 1
+            continue
+        todo[fp] = (rel, st, digest, prev)
+
+    # pipeline: files are extracted on a process pool, and new chunks are embedded
+    # on a background thread one group at a time while extraction continues
+    state = SimpleNamespace(index=index, embedded=0)
+    embed_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kb-embed")
+    embed_jobs, group_texts, group_ids = [], [], []
+    pages = failed = n_chunks = 0
+    t0 = time.perf_counter()
+
+    def flush_group():
+        if not group_texts:
+            return
+        if not EMBEDDER.available():
+            raise RuntimeError("OpenAI client not set. Call set_client(me.openai) at startup.")
+        embed_jobs.append(embed_pool.submit(
+            _embed_into_index, state, list(group_texts), np.array(group_ids, dtype="int64")))
+        group_texts.clear()
+        group_ids.clear()
+
+    try:
+        for res in iter_extracted(todo, cache=TEXT_CACHE):
+            fp = res.path
+            rel, st, digest, prev = todo[fp]
+            if res.error:
+                print(f"[KB] Extraction failed {fp}: {res.error}", flush=True)
+                failed += 1
+                if res.timed_out:
+                    # keep what was indexed before; the stale size/mtime makes the next build retry it
+                    if prev:
+                        files[rel] = prev
+                    continue
+            pages += res.pages
+            # an unreadable file is recorded with no chunks, so it is skipped until it changes
+            chunks = _split_md(res.text) if res.text.strip() else []
+            if not chunks:
+                print(f"[KB] Warning: {fp} has no extractable text", flush=True)
+            else:
+                print(f"[KB] Split {fp} into {len(chunks)} chunks ({res.seconds:.2f}s)", flush=True)
+            n_chunks += len(chunks)
+
+            # Count PDFs vs other files
+            if fp.lower().endswith('.pdf'):
+                pdf_count += 1
+            else:
+                other_count += 1
+
+            # chunks whose text did not change keep their id (and vector)
+            reusable = defaultdict(list)
+            if prev:
+                for cid, h in zip(prev["chunk_ids"], prev["chunk_hashes"]):
+                    reusable[h].append(cid)
+            # other changed chunks may be near-duplicates of chunks indexed from other files
+            own_ids = set(prev["chunk_ids"]) if prev else set()
+            ids, hashes = [], []
+            for ch in chunks:
+                h = _chunk_hash(ch)
+                if reusable[h]:
+                    cid = reusable[h].pop()
+                else:
+                    sig = lsh.signature(ch) if lsh is not None else None
+                    dup = lsh.query(sig, exclude=own_ids.union(ids)) if sig is not None else None
+                    if dup is not None:
+                        cid = dup
+                        deduped += 1
+                    else:
+                        cid = next_id
+                        next_id += 1
+                        group_texts.append(ch)
+                        group_ids.append(cid)
+                        new_rows.append({"id": cid, "chunk": ch, "source": rel})
+                        if sig is not None:
+                            lsh.add(cid, sig)
+                ids.append(cid)
+                hashes.append(h)
+            files[rel] = {"size": st.st_size, "mtime": st.st_mtime_ns, "sha256": digest,
+                          "chunk_ids": ids, "chunk_hashes": hashes}
+            if len(group_texts) >= KB_EMBED_GROUP:
+                flush_group()
+        t_extract = time.perf_counter() - t0
+        flush_group()
+        for job in embed_jobs:
+            job.result()
+    finally:
+        embed_pool.shutdown(wait=True, cancel_futures=True)
+    index = state.index
+
+    if todo:
+        elapsed = max(time.perf_counter() - t0, 1e-9)
+        print(f"[KB] Extracted {len(todo) - failed}/{len(todo)} files in {t_extract:.1f}s "
+              f"({pdf_count} PDFs, {other_count} other, {failed} failed); pipeline {elapsed:.1f}s: "
+              f"{len(todo) / elapsed:.1f} files/s, {pages / elapsed:.1f} pages/s, "
+              f"{n_chunks / elapsed:.1f} chunks/s, {len(new_rows)} chunks embedded", flush=True)
+
+    for rel in old_files:
+        if rel not in files:
+            print(f"[KB] Removing deleted file: {rel}", flush=True)
+    # a chunk goes once no file uses it any more (near-duplicates share ids)
+    old_owners, owners = _chunk_owners(old_files), _chunk_owners(files)
+    remove_ids = sorted(set(old_owners) - set(owners))
+    if deduped:
+        refs = sum(len(f["chunk_ids"]) for f in files.values())
+        print(f"[KB] Dedup: {deduped} new chunks were near-duplicates of indexed ones and were not embedded; "
+              f"{refs} chunks across files -> {len(owners)} unique ({1 - len(owners) / max(refs, 1):.1%} smaller)",
+              flush=True)
+
+    if not new_rows and not remove_ids and manifest is not None and owners == old_owners and \
+            not (index is not None and ann_index.needs_rebuild(index)):
+        if KB_LEXICAL.count() != len(meta):
+            # e.g. first start with an index built before the lexical index existed
+            KB_LEXICAL.update(meta.rows(), replace=True)
+            print(f"[KB] Lexical index rebuilt ({len(meta)} chunks)", flush=True)
+        _write_manifest(files, next_id)
+        print(f"[KB] Index up to date ({len(meta)} chunks, {unchanged} unchanged files).", flush=True)
+        return len(meta)
+
+    if remove_ids and index is not None:
+        index = ann_index.remove_ids(index, remove_ids)
+
+    if index is None:
         print("[KB] No indexable text found.", flush=True)
         return 0
+    if ann_index.needs_rebuild(index):
+        t_ann = time.perf_counter()
+        index = ann_index.rebuild(index)
+        print(f"[KB] Rebuilt index as {ann_index.describe(index)} for {index.ntotal} chunks "
+              f"in {time.perf_counter() - t_ann:.1f}s", flush=True)
+
+    def with_sources(cid, chunk, primary):
+        # every file the chunk appears in, the one it was first indexed from first
+        group = owners.get(cid) or [primary]
+        return cid, chunk, sorted(group, key=lambda rel: rel != primary)
+
+    # surviving rows stream from the old store in id order; new ids are all larger
+    removed = set(remove_ids)
+    old_rows = meta.rows() if isinstance(meta, ChunkStore) else ()
+    rows = itertools.chain(
+        (with_sources(*r) for r in old_rows if r[0] not in removed),
+        (with_sources(r["id"], r["chunk"], r["source"]) for r in new_rows),
+    )
+    # write to temp files and swap in, so KB_INDEX never reads a partial file
+    faiss.write_index(index, FAISS_INDEX + ".tmp")
+    n = write_chunk_store(FAISS_STORE, rows)
+    os.replace(FAISS_INDEX + ".tmp", FAISS_INDEX)
+    if manifest is not None and KB_LEXICAL.count() == len(meta):
+        KB_LEXICAL.update(((r["id"], r["chunk"], r["source"]) for r in new_rows), remove_ids)
+    else:
+        KB_LEXICAL.update(ChunkStore(FAISS_STORE, use_mmap=False).rows(), replace=True)
+    if lsh is not None:
+        _save_dedup(lsh, owners)
+    _write_manifest(files, next_id)
+    KB_INDEX.reload()
+
+    print(f"[KB] Successfully indexed {n} chunks "
+          f"({len(new_rows)} embedded, {len(remove_ids)} removed, {unchanged} unchanged files).", flush=True)
+    return n
+
+
+def _migrate_jsonl_store():
+    """Convert a store.jsonl left by an older version into the chunk store (no re-embedding)."""
+    rows = {}
+    with open(FAISS_STORE_JSONL, "r", encoding="utf-8") as f:
+        for pos, line in enumerate(f):
+            row = json.loads(line)
+            # stores written before the manifest have no ids: FAISS ids are positions
+            rows[row.get("id", pos)] = (row["chunk"], row["source"])
+    n = write_chunk_store(FAISS_STORE, ((cid, *rows[cid]) for cid in sorted(rows)))
+    os.remove(FAISS_STORE_JSONL)
+    print(f"[KB] Migrated {FAISS_STORE_JSONL} to {FAISS_STORE} ({n} chunks)", flush=True)
+
+def _load_index(mmap: bool = KB_INDEX_MMAP):
+    """(index, ChunkStore) from disk, or (None, {}) if there is no index yet.
+
+    With mmap, FAISS reads the index through a memory map (on releases that
+    have IO_FLAG_MMAP_IFC the flat vectors stay mapped instead of copied) and
+    the chunk store decodes texts straight from the mapped file.
+    """
+    if not os.path.exists(FAISS_STORE) and os.path.exists(FAISS_STORE_JSONL):
+        _migrate_jsonl_store()
+    if not (os.path.exists(FAISS_INDEX) and os.path.exists(FAISS_STORE)):
+        return None, {}
+    meta = ChunkStore(FAISS_STORE, use_mmap=mmap)
+    built_with = _index_embedder()
+    if built_with not in (None, EMBEDDER.name):
+        # vectors from another backend can't be compared with ours: keyword search only until rebuilt
+        print(f"[KB] Index was built with {built_with!r} embeddings, not {EMBEDDER.name!r}; "
+              "vector search is off until the index is rebuilt", flush=True)
+        return None, meta
+    import faiss
+    flags = (faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)) if mmap else 0
+    index = ann_index.configure(faiss.read_index(FAISS_INDEX, flags))
+    return index, meta
 
-    print(f"[KB] Indexing {len(texts)} chunks ({pdf_count} PDFs, {other_count} other files)...", flush=True)
-    vecs = embed_texts(texts)
-    mat = np.array(vecs, dtype="float32")
-    faiss.normalize_L2(mat)
-    index = faiss.IndexFlatIP(mat.shape[1])
-    index.add(mat)
-
-    faiss.write_index(index, FAISS_INDEX)
-    with open(FAISS_STORE, "w", encoding="utf-8") as f:
-        for t, m in zip(texts, meta):
-            f.write(json.dumps({"chunk": t, **m}, ensure_ascii=False) + "\n")
+class KBIndexHandle:
+    """Process-wide (index, meta) pair, loaded once (memory-mapped, see KB_INDEX_MMAP).
 
-    print(f"[KB] Successfully indexed {len(texts)} chunks from assignments ({pdf_count} PDFs, {other_count} other files).", flush=True)
-    return len(texts)
+    The files on disk are only re-read when their mtime/size change or when
+    reload() is called. Readers get an immutable snapshot, so a concurrent
+    reload never hands out a half-swapped pair.
+    """
 
+    def __init__(self, index_path: str, store_path: str):
+        self.index_path = index_path
+        self.store_path = store_path
+        self._lock = threading.Lock()
+        self._signature = False  # not loaded yet; None means "no index on disk"
+        self._snapshot = (None, {})
 
-def _load_index():
-    if not (os.path.exists(FAISS_INDEX) and os.path.exists(FAISS_STORE)):
-        return None, []
-    index = faiss.read_index(FAISS_INDEX)
-    with open(FAISS_STORE, "r", encoding="utf-8") as f:
-        meta = [json.loads(line) for line in f]
-    return index, meta
+    def _stat_signature(self):
+        try:
+            a = os.stat(self.index_path)
+            b = os.stat(self.store_path)
+        except OSError:
+            return None
+        return (a.st_mtime_ns, a.st_size, b.st_mtime_ns, b.st_size)
+
+    def get(self):
+        sig = self._stat_signature()
+        if sig == self._signature:
+            return self._snapshot
+        with self._lock:
+            sig = self._stat_signature()
+            if sig != self._signature:
+                self._load(sig)
+            return self._snapshot
+
+    def reload(self):
+        with self._lock:
+            self._load(self._stat_signature())
+            return self._snapshot
+
+    def _load(self, sig):
+        if sig is None and os.path.exists(FAISS_STORE_JSONL) and not os.path.exists(self.store_path):
+            # an index saved before the chunk store: convert its store, then load it as usual
+            try:
+                _migrate_jsonl_store()
+                sig = self._stat_signature()
+            except Exception as e:
+                print(f"[KB] Could not migrate {FAISS_STORE_JSONL}: {e}", flush=True)
+        if sig is None:
+            self._snapshot = (None, {})
+            self._signature = None
+            return
+        try:
+            index, meta = _load_index()
+        except Exception as e:
+            # e.g. files swapped mid-read by a concurrent build; retry on next call
+            print(f"[KB] Index reload failed, keeping previous snapshot: {e}", flush=True)
+            return
+        if index is not None and index.ntotal != len(meta):
+            print(f"[KB] Index/store size mismatch ({index.ntotal} vs {len(meta)}); keeping previous snapshot", flush=True)
+            return
+        self._snapshot = (index, meta)
+        self._signature = sig
+        kind = ann_index.describe(index) if index is not None else "none"
+        print(f"[KB] Loaded FAISS index into memory ({len(meta)} chunks, {kind}).", flush=True)
+
+KB_INDEX = KBIndexHandle(FAISS_INDEX, FAISS_STORE)
+KB_LEXICAL = KBLexicalIndex(FAISS_LEXICAL)
+
+def reload_index():
+    """Force the in-memory KB index to be re-read from disk."""
+    index, meta = KB_INDEX.reload()
+    return len(meta)
 
 def rebuild_if_empty():
-    """Rebuild if files exist but there are 0 meta rows."""
-    idx, meta = _load_index()
+    """Build the index if it is missing, otherwise sync it with kb/ (only changed files are re-embedded)."""
+    idx, meta = KB_INDEX.get()
     if idx is None or not meta:
         print("[INFO] FAISS check: index missing or empty — rebuilding…", flush=True)
-        n = build_faiss_index()
-        if n > 0:
-            print(f"[INFO] Successfully built FAISS index with {n} chunks.", flush=True)
-        else:
-            print("[WARNING] FAISS index build returned 0 chunks. Check KB folder.", flush=True)
-        return n
-    print(f"[INFO] FAISS check: loaded {len(meta)} chunks.", flush=True)
-    return len(meta)
+    else:
+        print(f"[INFO] FAISS check: loaded {len(meta)} chunks — syncing with kb/…", flush=True)
+    n = build_faiss_index()
+    if n > 0:
+        print(f"[INFO] FAISS index ready with {n} chunks.", flush=True)
+    else:
+        print("[WARNING] FAISS index build returned 0 chunks. Check KB folder.", flush=True)
+    return n
+
+_QUERY_EMBED_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("RAG_EMBED_WORKERS", "16")), thread_name_prefix="rag-embed")
 
-def rag_search(query: str, k: int = 4):
-    if CLIENT is None:
-        raise RuntimeError("OpenAI client not set. Call set_client(me.openai) at startup.")
-    index, meta = _load_index()
-    if not index or not meta:
+def _embed_queries(queries):
+    """Normalized query matrix (one embedding call for all rows), or None if
+    embeddings are unavailable or slower than RAG_EMBED_BUDGET_S."""
+    if not EMBEDDER.available():
+        return None
+    # a late result still lands in EMBED_CACHE, so a repeated query is fast next time
+    job = None if EMBEDDER.local else _QUERY_EMBED_POOL.submit(embed_texts, list(queries))
+    try:
+        vecs = embed_texts(list(queries)) if job is None else job.result(timeout=RAG_EMBED_BUDGET_S)
+    except FutureTimeout:
+        print(f"[RAG] Query embedding over {RAG_EMBED_BUDGET_S}s budget — lexical results only", flush=True)
+        return None
+    except Exception as e:
+        print(f"[RAG] Query embedding failed ({e}) — lexical results only", flush=True)
+        return None
+    import faiss
+    qm = np.vstack([np.asarray(v, dtype="float32") for v in vecs])
+    faiss.normalize_L2(qm)
+    return qm
+
+def _rrf(*rankings):
+    """Reciprocal-rank fusion of id lists (best first) into one [(id, score)] ranking."""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking):
+            fused[cid] += 1.0 / (RRF_K + rank + 1)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
+
+def _candidate_vectors(index, ids):
+    """Stored vectors of the candidate chunks, or None if the index can't provide them."""
+    try:
+        return ann_index.reconstruct(index, ids)
+    except Exception as e:
+        print(f"[RAG] Candidate vectors unavailable ({e}) — no MMR reranking", flush=True)
+        return None
+
+def rag_search(query: Union[str, Sequence[str]], k: int = 4, budget_tokens: int = RAG_CONTEXT_TOKENS):
+    """Up to k KB passages for one query or several, fusing BM25 and vector rankings (RRF).
+
+    Several queries share one embedding call and one batched FAISS search;
+    all their rankings are fused, so a passage found by more than one query
+    appears once (and ranks higher). Short keyword queries that match
+    lexically, and any query whose embedding is unavailable or over budget,
+    are answered from the lexical index alone. The fused candidates are
+    reranked with MMR, so near-duplicates give way to other passages, and
+    packed within budget_tokens (counted as they will appear in the JSON tool
+    result) with a cap per source; each passage is labelled with its cosine
+    similarity to the query (BM25 score if lexical).
+    """
+    t0 = time.perf_counter()
+    index, meta = KB_INDEX.get()
+    if not meta:
+        metrics.RAG_SECONDS.observe(time.perf_counter() - t0, "empty_kb")
         return "(KB empty)"
-    qv = np.array(embed_texts([query])[0], dtype="float32").reshape(1, -1)
-    faiss.normalize_L2(qv)
-    scores, idxs = index.search(qv, k)
+    queries = [query] if isinstance(query, str) else list(query)
+    queries = list(dict.fromkeys(q.strip() for q in queries if q and q.strip()))
+    if not queries:
+        metrics.RAG_SECONDS.observe(time.perf_counter() - t0, "no_query")
+        return "(no matches)"
+    n_cand = max(3 * k, 20)
+    bm25 = {}
+    lexical = []
+    for q in queries:
+        hits = [(cid, score) for cid, score in KB_LEXICAL.search(q, n_cand) if cid in meta]
+        lexical.append([cid for cid, _ in hits])
+        for cid, score in hits:
+            bm25[cid] = max(score, bm25.get(cid, score))
+    to_embed = [q for q, lex in zip(queries, lexical)
+                if not (lex and len(query_terms(q)) <= RAG_KEYWORD_TERMS)]
+    dense, qm = [], None
+    if index is not None and to_embed:
+        qm = _embed_queries(to_embed)
+        if qm is not None:
+            with metrics.FAISS_SECONDS.time():
+                _, idxs = index.search(qm, n_cand)
+            dense = [[int(i) for i in row if i != -1 and int(i) in meta] for row in idxs]
+    has_dense, has_lexical = any(dense), any(lexical)
+    mode = "hybrid" if has_dense and has_lexical else "dense" if has_dense else "lexical"
+    fused = _rrf(*dense, *lexical)[:n_cand]
+    if not fused:
+        metrics.RAG_SECONDS.observe(time.perf_counter() - t0, mode)
+        print(f"[DEBUG] rag_search ({mode}, {len(queries)} queries) found 0 chunks", flush=True)
+        return "(no matches)"
+    ids = [cid for cid, _ in fused]
+    rows = [meta[cid] for cid in ids]
+    rel = np.array([score for _, score in fused], dtype="float32")
+    rel /= rel.max()
+    rel += RAG_SOURCE_BOOST * np.array([bool(RAG_BOOST_RE.search(r['source'])) for r in rows], dtype="float32")
+    vecs = _candidate_vectors(index, ids) if index is not None else None
+    sims = None
+    if vecs is not None:
+        import faiss
+        faiss.normalize_L2(vecs)
+        if qm is not None:
+            sims = (vecs @ qm.T).max(axis=1)
+    passages = []
+    for i, (cid, row) in enumerate(zip(ids, rows)):
+        source = row['source']
+        if row.get("also"):
+            source = f"{source}; also in {', '.join(row['also'])}"
+        score = f"sim {sims[i]:.2f}" if sims is not None else f"bm25 {bm25[cid]:.3g}" if cid in bm25 else "rrf"
+        passages.append(f"[{source} ({score})] {row['chunk']}")
+    order = mmr_order(rel, vecs)
+    # +1: the blank line between passages
+    keep = pack(order, [r['source'] for r in rows], passages, k, budget_tokens,
+                count=lambda p: count_tokens(json.dumps(p)) + 1)
+    out = [passages[i] for i in keep]
+    sources = [rows[i]['source'] for i in keep]
+    metrics.RAG_SECONDS.observe(time.perf_counter() - t0, mode)
+    print(f"[DEBUG] rag_search ({mode}, {len(queries)} queries) kept {len(out)} of {len(fused)} candidates, "
+          f"sources: {sources}", flush=True)
+    return "\n\n".join(out)
+
+def rag_lookup(query: str = "", k: int = 4, queries: Optional[List[str]] = None, budget_tokens: Optional[int] = None):
+    """budget_tokens: this result's share of the turn's tool budget (set by Me, not by the model)."""
+    budget = RAG_CONTEXT_TOKENS
+    if budget_tokens is not None:
+        budget = min(budget, budget_tokens - count_tokens(json.dumps({"context": ""})))
+    return {"context": rag_search([query, *(queries or [])], k, budget)}
+
+def _rag_queries(tool_calls) -> List[str]:
+    """Every query of the rag_lookup calls in one assistant message."""
     out = []
-    for s, i in zip(scores[0], idxs[0]):
-        if i == -1: 
+    for tc in tool_calls:
+        if tc.function.name != "rag_lookup":
+            continue
+        try:
+            args = json.loads(tc.function.arguments)
+        except ValueError:
             continue
-        source = meta[i]['source']
-        chunk = meta[i]['chunk']
-        # Prioritize PDFs and assignments in output
-        if any(keyword in source.lower() for keyword in ['.pdf', 'hw', 'assignment', 'dama']):
-            out.insert(0, f"[{source}] {chunk}")  # Put PDFs first
-        else:
-            out.append(f"[{source}] {chunk}")
-    result = "\n\n".join(out) if out else "(no matches)"
-    print(f"[DEBUG] rag_search found {len(out)} chunks, sources: {[meta[i]['source'] for i in idxs[0] if i != -1]}", flush=True)
-    return result
-
-def rag_lookup(query: str, k: int = 4):
-    return {"context": rag_search(query, k)}
+        out += [q for q in [args.get("query"), *(args.get("queries") or [])] if isinstance(q, str) and q.strip()]
+    return out
+
+def prefetch_query_embeddings(queries: List[str]):
+    """Embed the queries of several separate rag_lookup calls in one request (into EMBED_CACHE)."""
+    if not EMBEDDER.local:
+        _embed_queries(list(dict.fromkeys(q.strip() for q in queries)))
 
 rag_lookup_json = {
     "name": "rag_lookup",
-    "description": "Search Panos's personal knowledge base containing actual assignment PDFs, notebooks, and project files from the /kb folder. ALWAYS use this for questions about projects, assignments, studies, or coursework. Returns content from real files in the knowledge base.",
+    "description": "Search Panos's personal knowledge base containing actual assignment PDFs, notebooks, and project files from the /kb folder. ALWAYS use this for questions about projects, assignments, studies, or coursework. Matches exact keywords (course codes, folder/file names) as well as meaning. Returns content from real files in the knowledge base.",
     "parameters": {
         "type": "object",
         "properties": {
             "query": {"type": "string", "description": "What to search in the KB - use specific terms like 'project', 'assignment', 'homework', 'DAMA', 'clustering', 'R script', etc."},
-            "k": {"type": "integer", "description": "Top-K passages to retrieve. Use higher values (8-12) for project/assignment questions to get more comprehensive results.", "default": 8}
+            "k": {"type": "integer", "description": "Top-K passages to retrieve. Use higher values (8-12) for project/assignment questions to get more comprehensive results.", "default": 8},
+            "queries": {"type": "array", "items": {"type": "string"}, "description": "Optional related queries (other phrasings, sub-topics) searched in the same call instead of calling rag_lookup again; results are merged and deduplicated into one top-K list."}
         },
         "required": ["query"],
         "additionalProperties": False
@@ -401,57 +849,20 @@ rag_lookup_json = {
 # =========================
 os.makedirs("data", exist_ok=True)
 QADB = "data/qadb.sqlite"
-
-def _qadb_conn():
-    con = sqlite3.connect(QADB)
-    con.execute("PRAGMA journal_mode=WAL;")
-    con.execute("PRAGMA synchronous=NORMAL;")
-    con.execute("""
-    CREATE TABLE IF NOT EXISTS qa(
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      question TEXT NOT NULL,
-      answer TEXT NOT NULL,
-      tags TEXT,
-      created_at TEXT DEFAULT CURRENT_TIMESTAMP
-    );""")
-    con.execute("""
-    CREATE VIRTUAL TABLE IF NOT EXISTS qa_fts USING fts5(
-      question, answer, tags, content='',
-      tokenize = 'unicode61 remove_diacritics 2'
-    );""")
-    return con
+QADB_STORE = QADBStore(QADB)
 
 def qadb_lookup(question: str, fuzzy: bool = True, limit: int = 5):
-    con = _qadb_conn(); cur = con.cursor()
-    if fuzzy:
-        try:
-            cur.execute("""
-              SELECT question, answer, tags
-              FROM qa_fts
-              WHERE qa_fts MATCH ?
-              ORDER BY bm25(qa_fts) ASC
-              LIMIT ?;
-            """, (f'"{question}"', limit))
-        except sqlite3.OperationalError:
-            cur.execute("""
-              SELECT question, answer, tags
-              FROM qa_fts
-              WHERE qa_fts MATCH ?
-              ORDER BY bm25(qa_fts) ASC
-              LIMIT ?;
-            """, (question, limit))
-    else:
-        cur.execute("SELECT question,answer,tags FROM qa WHERE question = ? ORDER BY id DESC LIMIT ?",
-                    (question, limit))
-    rows = cur.fetchall(); con.close()
-    return {"results": [{"question": q, "answer": a, "tags": t} for (q, a, t) in rows]}
+    with metrics.QADB_SECONDS.time("lookup"):
+        rows = QADB_STORE.lookup(question, fuzzy, limit)
+    return {"results": [{"question": q, "answer": a, "tags": t, "score": score} for (q, a, t, score) in rows]}
 
 def qadb_upsert(question: str, answer: str, tags: str = None):
-    con = _qadb_conn(); cur = con.cursor()
-    cur.execute("INSERT INTO qa(question,answer,tags) VALUES (?,?,?)", (question, answer, tags))
-    cur.execute("INSERT INTO qa_fts(rowid, question, answer, tags) VALUES (last_insert_rowid(), ?, ?, ?)",
-                (question, answer, tags))
-    con.commit(); con.close()
+    with metrics.QADB_SECONDS.time("upsert"):
+        rowid = QADB_STORE.upsert(question, answer, tags)
+    try:
+        ANSWER_CACHE.add(rowid, question, answer)
+    except Exception as e:
+        print(f"[WARNING] Answer cache update failed: {e}", flush=True)
     return {"saved": True}
 
 def qadb_lookup_tool(question: str, fuzzy: bool = True, limit: int = 5):
@@ -460,9 +871,56 @@ def qadb_lookup_tool(question: str, fuzzy: bool = True, limit: int = 5):
 def qadb_upsert_tool(question: str, answer: str, tags: str = None):
     return qadb_upsert(question, answer, tags)
 
+# =========================
+# Semantic answer cache (skips the LLM for repeated questions)
+# =========================
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") != "0"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.93"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_ROWS = int(os.getenv("ANSWER_CACHE_MAX_ROWS", "5000"))
+
+def _qadb_answer_rows():
+    # oldest first, so the latest answer to a question wins
+    return reversed(QADB_STORE.recent(ANSWER_CACHE_MAX_ROWS))
+
+def _kb_index_mtime() -> float:
+    try:
+        return os.stat(FAISS_INDEX).st_mtime
+    except OSError:
+        return 0.0
+
+ANSWER_CACHE = SemanticAnswerCache(embed_texts, _qadb_answer_rows, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_S,
+                                   embed_many=embed_many)
+metrics.CallbackMetric("virtualme_answer_cache", "Semantic answer cache lookups.", ["result"],
+                       lambda: {("hit",): ANSWER_CACHE.stats["hits"], ("miss",): ANSWER_CACHE.stats["misses"]})
+
+def reusable_turn(message: str, history, question: str) -> bool:
+    """Whether this turn's answer may come from, or go to, the answer cache.
+
+    Only the first turn of a conversation qualifies: a follow-up's answer
+    depends on the earlier turns. An augmented message (a random assignment
+    for a "/kb/..." chip) doesn't either: its text doesn't identify the answer.
+    """
+    return not history and question == message
+
+def cached_answer(question: str) -> Optional[str]:
+    """A stored answer to a near-identical question, or None (see reusable_turn for when to ask)."""
+    if not ANSWER_CACHE_ENABLED or not (question or "").strip():
+        return None
+    try:
+        # answers saved before the KB index last changed may be stale
+        hit = ANSWER_CACHE.lookup(question, not_before=_kb_index_mtime())
+    except Exception as e:
+        print(f"[WARNING] Answer cache lookup failed: {e}", flush=True)
+        return None
+    if not hit:
+        return None
+    print(f"[DEBUG] Answer cache hit ({hit['score']:.3f}) for: {hit['question'][:80]}", flush=True)
+    return hit["answer"]
+
 qadb_lookup_json = {
     "name": "qadb_lookup_tool",
-    "description": "Search the reusable Q&A database for similar questions and answers.",
+    "description": "Search the reusable Q&A database for similar questions and answers (best matches first, with relevance scores).",
     "parameters": {
         "type": "object",
         "properties": {
@@ -497,10 +955,17 @@ tools = [
     {"type": "function", "function": qadb_upsert_json},
 ]
 
+# Tool calls of one turn run concurrently (bounded per turn), each with a timeout
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", "4"))
+TOOL_TIMEOUT_S = float(os.getenv("TOOL_TIMEOUT_S", "20"))
+TOOL_TIMEOUTS = {"qadb_lookup_tool": 5.0, "qadb_upsert_tool": 5.0}
+# shared pool: a timed-out tool keeps its thread until it returns, so size it generously
+_TOOL_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("TOOL_WORKERS", "32")), thread_name_prefix="tool")
+
 # =========================
 # Evaluator / Reflector
 # =========================
-def evaluate_answer(client: OpenAI, user_q: str, context: str, draft: str):
+def _evaluator_messages(user_q: str, context: str, draft: str):
     eval_sys = {
         "role": "system",
         "content": (
@@ -509,13 +974,13 @@ def evaluate_answer(client: OpenAI, user_q: str, context: str, draft: str):
             "Return strict JSON: {\"helpfulness\":int, \"faithfulness\":int, \"style\":int, \"feedback\":string}."
         ),
     }
-    msgs = [
+    return [
         eval_sys,
         {"role": "user", "content": f"USER:\n{user_q}\n\nCONTEXT:\n{context}\n\nDRAFT:\n{draft}"},
     ]
-    resp = client.chat.completions.create(model=CHAT_MODEL, messages=msgs)
-    text = resp.choices[0].message.content or "{}"
-    m = re.search(r"\{.*\}", text, re.S)
+
+def _parse_evaluation(text: str):
+    m = re.search(r"\{.*\}", text or "{}", re.S)
     if not m:
         return {"helpfulness": 3, "faithfulness": 3, "style": 3, "feedback": "(no-parse)"}
     try:
@@ -523,7 +988,7 @@ def evaluate_answer(client: OpenAI, user_q: str, context: str, draft: str):
     except Exception:
         return {"helpfulness": 3, "faithfulness": 3, "style": 3, "feedback": "(bad-json)"}
 
-def reflect_answer(client: OpenAI, user_q: str, context: str, draft: str, feedback: str):
+def _reflector_messages(user_q: str, context: str, draft: str, feedback: str):
     refl_sys = {
         "role": "system",
         "content": (
@@ -531,13 +996,144 @@ def reflect_answer(client: OpenAI, user_q: str, context: str, draft: str, feedba
             "Keep claims tied to the provided context. Be concise and clear."
         ),
     }
-    msgs = [
+    return [
         refl_sys,
         {"role": "user", "content": f"USER:\n{user_q}\n\nCONTEXT:\n{context}\n\nDRAFT:\n{draft}\n\nFEEDBACK:\n{feedback}"},
     ]
-    resp = client.chat.completions.create(model=CHAT_MODEL, messages=msgs)
+
+def evaluate_answer(client: OpenAI, user_q: str, context: str, draft: str):
+    t0 = time.perf_counter()
+    resp = client.chat.completions.create(model=CHAT_MODEL, messages=_evaluator_messages(user_q, context, draft))
+    _observe_llm("evaluator", t0, resp)
+    return _parse_evaluation(resp.choices[0].message.content)
+
+def reflect_answer(client: OpenAI, user_q: str, context: str, draft: str, feedback: str):
+    t0 = time.perf_counter()
+    resp = client.chat.completions.create(model=CHAT_MODEL, messages=_reflector_messages(user_q, context, draft, feedback))
+    _observe_llm("reflector", t0, resp)
+    return resp.choices[0].message.content
+
+async def aevaluate_answer(client: AsyncOpenAI, user_q: str, context: str, draft: str):
+    t0 = time.perf_counter()
+    resp = await client.chat.completions.create(model=CHAT_MODEL, messages=_evaluator_messages(user_q, context, draft))
+    _observe_llm("evaluator", t0, resp)
+    return _parse_evaluation(resp.choices[0].message.content)
+
+async def areflect_answer(client: AsyncOpenAI, user_q: str, context: str, draft: str, feedback: str):
+    t0 = time.perf_counter()
+    resp = await client.chat.completions.create(model=CHAT_MODEL, messages=_reflector_messages(user_q, context, draft, feedback))
+    _observe_llm("reflector", t0, resp)
     return resp.choices[0].message.content
 
+# Quality control of drafts:
+#   inline     - evaluate every answer before replying, reflect if weak (default)
+#   background - reply with the draft; evaluate afterwards, only for QADB saving + the eval log
+#   sampled    - evaluate (and possibly reflect) inline on QC_SAMPLE_RATE of turns, skip the rest
+QC_MODE = os.getenv("QC_MODE", "inline").strip().lower()
+QC_SAMPLE_RATE = float(os.getenv("QC_SAMPLE_RATE", "0.25"))
+EVAL_LOG = os.getenv("EVAL_LOG", "data/evaluations.jsonl")
+_QC_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="qc")
+_EVAL_LOG_LOCK = threading.Lock()
+
+def _qc_plan() -> str:
+    """What to do with this turn's draft: "inline", "background" or "skip"."""
+    if QC_MODE == "background":
+        return "background"
+    if QC_MODE == "sampled":
+        return "inline" if random.random() < QC_SAMPLE_RATE else "skip"
+    return "inline"
+
+def record_evaluation(question: str, draft: str, final: str, ev: dict, mode: str, seconds: float):
+    """Append one evaluation to EVAL_LOG (JSONL) for offline analysis."""
+    row = {
+        "ts": time.time(),
+        "mode": mode,
+        "question": question,
+        "draft_chars": len(draft or ""),
+        "reflected": final != draft,
+        "helpfulness": ev.get("helpfulness"),
+        "faithfulness": ev.get("faithfulness"),
+        "style": ev.get("style"),
+        "feedback": ev.get("feedback"),
+        "seconds": round(seconds, 3),
+    }
+    try:
+        with _EVAL_LOG_LOCK, open(EVAL_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"[WARNING] Could not record evaluation: {e}", flush=True)
+
+def _needs_reflection(ev: dict) -> bool:
+    return ev.get("helpfulness", 3) < 4 or ev.get("faithfulness", 3) < 4
+
+def _worth_saving(ev: dict, final: str) -> bool:
+    fb = (ev.get("feedback", "") or "").lower()
+    return len(final or "") <= 1500 and any(k in fb for k in ["clear", "helpful", "well structured", "faithful"])
+
+def _tool_context(messages) -> str:
+    """Tool outputs of a turn, used as "context" for evaluation."""
+    ctx_snippets = []
+    for m in messages:
+        if isinstance(m, dict) and m.get("role") == "tool":
+            ctx_snippets.append(m.get("content", ""))
+    return "\n\n".join(ctx_snippets) if ctx_snippets else "(no ctx)"
+
+class _StreamedTurn:
+    """Accumulates chat.completions stream chunks into content + tool calls."""
+
+    def __init__(self):
+        self.content = []
+        self.calls = {}
+        self.finish_reason = None
+        self.started = False
+        self.usage = None  # sent in a last, choice-less chunk (stream_options.include_usage)
+
+    def feed(self, chunk) -> str:
+        """Consume one chunk; returns its text delta ("" if none)."""
+        self.started = True
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return ""
+        choice = chunk.choices[0]
+        delta = choice.delta
+        # tool calls arrive as fragments keyed by index
+        for tc in delta.tool_calls or []:
+            slot = self.calls.setdefault(tc.index, {"id": None, "name": "", "arguments": ""})
+            if tc.id:
+                slot["id"] = tc.id
+            if tc.function is not None:
+                slot["name"] += tc.function.name or ""
+                slot["arguments"] += tc.function.arguments or ""
+        if choice.finish_reason:
+            self.finish_reason = choice.finish_reason
+        if delta.content:
+            self.content.append(delta.content)
+            return delta.content
+        return ""
+
+    @property
+    def wants_tools(self) -> bool:
+        return self.finish_reason == "tool_calls" and bool(self.calls)
+
+    def text(self) -> str:
+        return "".join(self.content)
+
+    def message(self):
+        """Same shape as a non-streamed assistant message."""
+        return SimpleNamespace(
+            role="assistant",
+            content=self.text(),
+            tool_calls=[
+                SimpleNamespace(
+                    id=c["id"],
+                    type="function",
+                    function=SimpleNamespace(name=c["name"], arguments=c["arguments"] or "{}"),
+                )
+                for c in (self.calls[i] for i in sorted(self.calls))
+            ],
+        )
+
 def _assistant_msg_to_dict(msg):
     out = {"role": msg.role, "content": msg.content or ""}
     if getattr(msg, "tool_calls", None):
@@ -559,30 +1155,68 @@ def _assistant_msg_to_dict(msg):
 class Me:
     def __init__(self):
         self.openai = OpenAI()
+        self.aopenai = AsyncOpenAI()
+        self._qc_tasks = set()
         self.name = "Panagiotis Paltsokas"
 
-        # Read LinkedIn PDF as plain text
-        reader = PdfReader("me/linkedin.pdf")
-        self.linkedin = ""
-        for page in reader.pages:
-            text = page.extract_text()
-            if text:
-                self.linkedin += text
+        # Read LinkedIn PDF as plain text (parsed once per file version, see TEXT_CACHE)
+        self.linkedin = read_any_to_text("me/linkedin.pdf")
 
         # Read summary file
         with open("me/summary.txt", "r", encoding="utf-8") as f:
             self.summary = f.read()
 
-    def handle_tool_call(self, tool_calls):
-        results = []
-        for tool_call in tool_calls:
-            tool_name = tool_call.function.name
-            arguments = json.loads(tool_call.function.arguments)
-            print(f"Tool called: {tool_name}", flush=True)
-            tool = globals().get(tool_name)
+        # the system prompt is fixed for the process: build and count it once
+        self.context = ContextAssembler(self.system_prompt(), CHAT_MODEL)
+
+    def _run_tool(self, tool_call, budget: Optional[int] = None):
+        tool_name = tool_call.function.name
+        arguments = json.loads(tool_call.function.arguments)
+        if tool_name == "rag_lookup" and budget is not None:
+            # pack passages for the share the result will get, so it isn't trimmed again
+            arguments["budget_tokens"] = budget
+        print(f"Tool called: {tool_name}", flush=True)
+        tool = globals().get(tool_name)
+        t0 = time.perf_counter()
+        try:
             result = tool(**arguments) if tool else {}
-            results.append({"role": "tool", "content": json.dumps(result), "tool_call_id": tool_call.id})
-        return results
+        except Exception:
+            metrics.TOOL_CALLS.labels(tool_name, "error").inc()
+            raise
+        finally:
+            metrics.TOOL_SECONDS.observe(time.perf_counter() - t0, tool_name)
+        metrics.TOOL_CALLS.labels(tool_name, "ok" if tool else "unknown").inc()
+        return {"role": "tool", "content": json.dumps(result), "tool_call_id": tool_call.id}
+
+    async def _arun_tool(self, tool_call, sem: asyncio.Semaphore, budget: Optional[int] = None):
+        name = tool_call.function.name
+        timeout = TOOL_TIMEOUTS.get(name, TOOL_TIMEOUT_S)
+        async with sem:
+            loop = asyncio.get_running_loop()
+            try:
+                # tools do blocking file / SQLite / FAISS / HTTP work: keep it off the event loop
+                return await asyncio.wait_for(loop.run_in_executor(_TOOL_POOL, self._run_tool, tool_call, budget), timeout)
+            except asyncio.TimeoutError:
+                metrics.TOOL_CALLS.labels(name, "timeout").inc()
+                print(f"[WARNING] Tool {name} timed out after {timeout}s", flush=True)
+                result = {"error": f"{name} timed out after {timeout:g}s"}
+            except Exception as e:
+                print(f"[WARNING] Tool {name} failed: {e}", flush=True)
+                result = {"error": f"{name} failed: {e}"}
+        return {"role": "tool", "content": json.dumps(result), "tool_call_id": tool_call.id}
+
+    async def ahandle_tool_call(self, tool_calls, budget: Optional[int] = None):
+        """Run one message's tool calls; budget is each result's token share (see TurnContext.tool_share)."""
+        # independent calls run concurrently; gather keeps the original order
+        sem = asyncio.Semaphore(TOOL_CONCURRENCY)
+        rag_queries = _rag_queries(tool_calls)
+        if len(rag_queries) > 1:
+            # separate rag_lookup calls: one embedding request for all of them, then cache hits
+            await asyncio.get_running_loop().run_in_executor(_TOOL_POOL, prefetch_query_embeddings, rag_queries)
+        return list(await asyncio.gather(*(self._arun_tool(tc, sem, budget) for tc in tool_calls)))
+
+    def handle_tool_call(self, tool_calls, budget: Optional[int] = None):
+        return asyncio.run(self.ahandle_tool_call(tool_calls, budget))
 
     def system_prompt(self):
         base = (
@@ -612,82 +1246,288 @@ class Me:
         return base + policy + summary + linkedin + closing
 
 
-    def chat(self, message, history):
-        if HELLO_THERE_RE.match(message or ""):
-            return "General Kenoooobiiii... I mean... Hi! How are you? 😊"
+    def _start_turn(self, message, history):
+        """TurnContext for a new turn: cached system prompt, the history that fits the budget, the message."""
+        return self.context.start(message, history)
 
-        messages = [{"role": "system", "content": self.system_prompt()}] + history + [{"role": "user", "content": message}]
+    def chat(self, message, history, question=None):
+        """`question` is what the visitor asked, if `message` was augmented with extra context."""
+        if HELLO_THERE_RE.match(message or ""):
+            return HELLO_THERE_REPLY
+        question = question or message
+        reusable = reusable_turn(message, history, question)
+        cached = cached_answer(question) if reusable else None
+        if cached:
+            return cached
+
+        ctx = self._start_turn(message, history)
         done = False
         draft = None
 
         while not done:
-            response = self.openai.chat.completions.create(model=CHAT_MODEL, messages=messages, tools=tools)
+            t0 = time.perf_counter()
+            response = self.openai.chat.completions.create(model=CHAT_MODEL, messages=ctx.messages, tools=tools)
+            _observe_llm("answer", t0, response)
             choice = response.choices[0]
             if choice.finish_reason == "tool_calls":
                 msg = choice.message
-                results = self.handle_tool_call(msg.tool_calls)
-                messages.append(_assistant_msg_to_dict(msg))
-                messages.extend(results)
+                results = self.handle_tool_call(msg.tool_calls, ctx.tool_share(len(msg.tool_calls)))
+                ctx.add_assistant(_assistant_msg_to_dict(msg))
+                ctx.add_tool_results(results)
             else:
                 done = True
                 draft = choice.message.content
+        print(ctx.report() + _usage_note(response), flush=True)
+
+        return self._review_answer(message, ctx.messages, draft, question, reusable)
 
-        # gather tool outputs to use as "context" for evaluation
-        ctx_snippets = []
-        for m in messages:
-            if isinstance(m, dict) and m.get("role") == "tool":
-                ctx_snippets.append(m.get("content", ""))
-        context_for_eval = "\n\n".join(ctx_snippets) if ctx_snippets else "(no ctx)"
+    async def achat(self, message, history, question=None):
+        """Async chat(): awaits the model and runs tools in worker threads, so the event loop stays free."""
+        if HELLO_THERE_RE.match(message or ""):
+            return HELLO_THERE_REPLY
+        question = question or message
+        reusable = reusable_turn(message, history, question)
+        cached = await asyncio.to_thread(cached_answer, question) if reusable else None
+        if cached:
+            return cached
+
+        ctx = self._start_turn(message, history)
+        while True:
+            t0 = time.perf_counter()
+            response = await self.aopenai.chat.completions.create(model=CHAT_MODEL, messages=ctx.messages, tools=tools)
+            _observe_llm("answer", t0, response)
+            choice = response.choices[0]
+            if choice.finish_reason != "tool_calls":
+                draft = choice.message.content
+                break
+            msg = choice.message
+            results = await self.ahandle_tool_call(msg.tool_calls, ctx.tool_share(len(msg.tool_calls)))
+            ctx.add_assistant(_assistant_msg_to_dict(msg))
+            ctx.add_tool_results(results)
+        print(ctx.report() + _usage_note(response), flush=True)
+
+        return await self._areview_answer(message, ctx.messages, draft, question, reusable)
+
+    async def achat_stream(self, message, history, question=None):
+        """Async generator of chat events (see /chat/stream for the event types)."""
+        if HELLO_THERE_RE.match(message or ""):
+            yield {"type": "done", "reply": HELLO_THERE_REPLY}
+            return
+        question = question or message
+        reusable = reusable_turn(message, history, question)
+        cached = await asyncio.to_thread(cached_answer, question) if reusable else None
+        if cached:
+            yield {"type": "done", "reply": cached}
+            return
+
+        ctx = self._start_turn(message, history)
+        while True:
+            t0 = time.perf_counter()
+            stream = await self.aopenai.chat.completions.create(
+                model=CHAT_MODEL, messages=ctx.messages, tools=tools, stream=True,
+                stream_options={"include_usage": True},
+            )
+            turn = _StreamedTurn()
+            async for chunk in stream:
+                if not turn.started:
+                    metrics.LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - t0, "answer")
+                text = turn.feed(chunk)
+                if text:
+                    yield {"type": "token", "text": text}
+            _observe_llm("answer", t0, turn)
+            if not turn.wants_tools:
+                draft = turn.text()
+                break
+            msg = turn.message()
+            for tc in msg.tool_calls:
+                yield {"type": "tool", "name": tc.function.name}
+            results = await self.ahandle_tool_call(msg.tool_calls, ctx.tool_share(len(msg.tool_calls)))
+            ctx.add_assistant(_assistant_msg_to_dict(msg))
+            ctx.add_tool_results(results)
+        print(ctx.report() + _usage_note(turn), flush=True)
+
+        final = await self._areview_answer(message, ctx.messages, draft, question, reusable)
+        if final != draft:
+            yield {"type": "replace", "reply": final}
+        yield {"type": "done", "reply": final}
+
+    def _review_answer(self, message, messages, draft, question=None, reusable=False):
+        """Apply the QC_MODE policy to a draft; returns the answer to send."""
+        plan = _qc_plan()
+        if plan == "skip":
+            return draft
+        if plan == "background":
+            _QC_POOL.submit(self._background_review, message, messages, draft, question, reusable)
+            return draft
+        return self._evaluate_and_save(message, messages, draft, question, reusable, reflect=True, mode=plan)
+
+    def _background_review(self, message, messages, draft, question, reusable):
+        try:
+            self._evaluate_and_save(message, messages, draft, question, reusable, reflect=False, mode="background")
+        except Exception as e:
+            print(f"[WARNING] Background evaluation failed: {e}", flush=True)
 
+    def _evaluate_and_save(self, message, messages, draft, question, reusable: bool, reflect: bool, mode: str):
+        """Evaluate the draft, reflect on it if weak (and allowed), record the scores and auto-save good answers.
+
+        Only `reusable` turns (see reusable_turn) are saved: QADB rows feed the answer cache.
+        """
+        t0 = time.perf_counter()
+        context_for_eval = _tool_context(messages)
         ev = evaluate_answer(self.openai, message, context_for_eval, draft)
         print(f"Evaluation: {ev}", flush=True)
         final = draft
-        if ev.get("helpfulness", 3) < 4 or ev.get("faithfulness", 3) < 4:
+        if reflect and _needs_reflection(ev):
             final = reflect_answer(self.openai, message, context_for_eval, draft, ev.get("feedback", ""))
+        record_evaluation(question or message, draft, final, ev, mode, time.perf_counter() - t0)
 
         # auto-save good reusable answers in QADB
         try:
-            fb = (ev.get("feedback", "") or "").lower()
-            if len(final) <= 1500 and any(k in fb for k in ["clear", "helpful", "well structured", "faithful"]):
+            if reusable and _worth_saving(ev, final):
                 qadb_upsert_tool(message, final, tags="virtual-me")
         except Exception:
             pass
 
         return final
 
+    async def _areview_answer(self, message, messages, draft, question=None, reusable=False):
+        plan = _qc_plan()
+        if plan == "skip":
+            return draft
+        if plan == "background":
+            task = asyncio.create_task(self._abackground_review(message, messages, draft, question, reusable))
+            # the loop only keeps weak references to tasks
+            self._qc_tasks.add(task)
+            task.add_done_callback(self._qc_tasks.discard)
+            return draft
+        return await self._aevaluate_and_save(message, messages, draft, question, reusable, reflect=True, mode=plan)
+
+    async def _abackground_review(self, message, messages, draft, question, reusable):
+        try:
+            await self._aevaluate_and_save(message, messages, draft, question, reusable, reflect=False, mode="background")
+        except Exception as e:
+            print(f"[WARNING] Background evaluation failed: {e}", flush=True)
+
+    async def _aevaluate_and_save(self, message, messages, draft, question, reusable: bool, reflect: bool, mode: str):
+        t0 = time.perf_counter()
+        context_for_eval = _tool_context(messages)
+        ev = await aevaluate_answer(self.aopenai, message, context_for_eval, draft)
+        print(f"Evaluation: {ev}", flush=True)
+        final = draft
+        if reflect and _needs_reflection(ev):
+            final = await areflect_answer(self.aopenai, message, context_for_eval, draft, ev.get("feedback", ""))
+        await asyncio.to_thread(record_evaluation, question or message, draft, final, ev, mode, time.perf_counter() - t0)
+
+        try:
+            if reusable and _worth_saving(ev, final):
+                await asyncio.to_thread(qadb_upsert_tool, message, final, "virtual-me")
+        except Exception:
+            pass
+
+        return final
+
+def _usage_note(response) -> str:
+    """Provider-reported prompt size (and prompt-cache hits) of the last model call, for the [CTX] log line."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return ""
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    return f"; API prompt_tokens {usage.prompt_tokens}" + (f" ({cached} cached)" if cached else "")
+
+def _observe_llm(purpose: str, t0: float, response):
+    """Record one chat.completions call (started at perf_counter t0) and its token usage."""
+    metrics.LLM_SECONDS.observe(time.perf_counter() - t0, purpose)
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    metrics.LLM_TOKENS.labels(purpose, "prompt").inc(usage.prompt_tokens or 0)
+    metrics.LLM_TOKENS.labels(purpose, "completion").inc(usage.completion_tokens or 0)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached:
+        metrics.LLM_TOKENS.labels(purpose, "cached_prompt").inc(cached)
+
 # =========================
 # Build Gradio app for both local & Spaces
 # =========================
-def build_demo():
-    me = Me()
-    set_client(me.openai)
+def build_demo(me: "Me"):
+    import gradio as gr
+    return gr.ChatInterface(me.achat, type="messages")
+
+# =========================
+# Startup: one shared Me, KB index loaded / synced in the background
+# =========================
+GRADIO_UI = os.getenv("GRADIO_UI", "1") != "0"  # 0 skips importing gradio entirely
+KB_WARMUP = os.getenv("KB_WARMUP", "background").strip().lower()  # background | blocking | off
+
+STARTUP = {"kb": "pending", "chunks": 0, "error": None, "started_at": time.time(), "ready_at": None}
+_READY = threading.Event()
+
+def _mark_ready():
+    if not _READY.is_set():
+        STARTUP["ready_at"] = time.time()
+        _READY.set()
+        print(f"[INFO] Ready after {STARTUP['ready_at'] - STARTUP['started_at']:.1f}s", flush=True)
 
-    # Build FAISS KB once (or rebuild if empty)
+def warm_up_kb():
+    """Load the index from disk, then sync it with kb/ (only changed files are re-embedded).
+
+    An existing index is served as soon as it is loaded; without one the app
+    becomes ready when the first build finishes (or fails).
+    """
     try:
+        STARTUP["kb"] = "loading"
+        _, meta = KB_INDEX.get()
+        if meta:
+            STARTUP["chunks"] = len(meta)
+            _mark_ready()
+        STARTUP["kb"] = "syncing"
         n = rebuild_if_empty()
         if n == 0:
             print("WARNING: KB has 0 chunks. Check files in 'kb/'", flush=True)
+        STARTUP.update(kb="ready", chunks=n)
     except Exception as e:
         print("KB build skipped / failed:", e, flush=True)
+        STARTUP.update(kb="failed", error=str(e))
+    finally:
+        _mark_ready()
 
-    return gr.ChatInterface(me.chat, type="messages")
-
-demo = build_demo()
-
-# Create ONE shared Me() instance for the /chat endpoint
+# ONE shared Me() instance for the /chat endpoints and the Gradio UI
 _shared_me = Me()
 set_client(_shared_me.openai)
 
+if KB_WARMUP == "blocking":
+    warm_up_kb()
+elif KB_WARMUP == "off":
+    STARTUP["kb"] = "off"
+    _mark_ready()
+else:
+    threading.Thread(target=warm_up_kb, name="kb-warmup", daemon=True).start()
+
 # Serve ./static (put your index.html here)
 root = Path(__file__).resolve().parent
 static_dir = root / "static"
 static_dir.mkdir(exist_ok=True)
 
-app = FastAPI(title="Panos — Career Conversations")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Optional Gradio UI at /gradio, built when the server starts rather than on import.
 
-# Optional: Gradio UI at /gradio
-# Note: Mount order matters - mount Gradio before other static routes
-gr.mount_gradio_app(app, demo, path="/gradio")
+    Gradio runs its own startup events from the lifespan of the app it is
+    mounted on, so it gets a sub-app whose lifespan runs inside this one.
+    """
+    if not GRADIO_UI:
+        yield
+        return
+    import gradio as gr
+    demo = await asyncio.to_thread(build_demo, _shared_me)
+    ui = gr.mount_gradio_app(FastAPI(), demo, path="")
+    async with ui.router.lifespan_context(ui):
+        app.mount("/gradio", ui)
+        yield
+
+app = FastAPI(title="Panos — Career Conversations", lifespan=lifespan)
 
 # Serve your single-file website at /
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
@@ -696,18 +1536,44 @@ app.mount("/static", StaticFiles(directory=static_dir), name="static")
 def index():
     return (static_dir / "index.html").read_text(encoding="utf-8")
 
-# Minimal schema for your new front-end
-@app.post("/chat")
-async def chat_api(payload: dict, request: Request):
-    """
-    Expects: {"message": "...", "history": [...]} (history is optional)
-    Returns: {"reply": "..."}
-    """
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and answering HTTP."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: 503 until the KB index is loaded or the startup build has finished."""
+    ready = _READY.is_set()
+    return JSONResponse({"ready": ready, **STARTUP}, status_code=200 if ready else 503)
+
+@app.get("/metrics")
+def metrics_api():
+    """Per-stage latency histograms, tool / token / cache counters (Prometheus text format)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/suggest")
+def suggest_api(q: str = "", limit: int = 8):
+    """Type-ahead for the chat box: stored questions matching what has been typed so far."""
+    if len(q.strip()) < 2:
+        return {"suggestions": []}
+    with metrics.QADB_SECONDS.time("suggest"):
+        items = QADB_STORE.suggest(q, max(1, min(limit, 20)))
+    return {"suggestions": items}
+
+def _parse_chat_payload(payload: dict):
     message = (payload or {}).get("message", "")
     history = (payload or {}).get("history", [])
     if not isinstance(history, list):
         history = []
-    
+    # older copies of the site also send the message as the last history turn
+    last = history[-1] if history else None
+    if isinstance(last, dict) and last.get("role") == "user" and last.get("content") == message:
+        history = history[:-1]
+    return message, history
+
+def _augment_with_assignment(message: str) -> str:
+    """For the "/kb/..." chips, pick a random assignment and append its text to the message."""
     augmented_message = message
     folder_targets: Optional[Sequence[str]] = None
     allowed_exts: Optional[Sequence[str]] = None
@@ -731,6 +1597,8 @@ async def chat_api(payload: dict, request: Request):
             if selection:
                 display_name, rel_path = selection
                 context = load_assignment_context(rel_path)
+                if context:
+                    context = truncate_to_tokens(context, CONTEXT_ASSIGNMENT_TOKENS, CHAT_MODEL)
                 repo_instruction = ""
                 if rel_path.startswith("Python_Courses_1/"):
                     parts = rel_path.split("/", 1)
@@ -766,9 +1634,22 @@ async def chat_api(payload: dict, request: Request):
     except Exception as e:
         print(f"[WARNING] Failed to select random assignment: {e}", flush=True)
         augmented_message = message
+    return augmented_message
+
+# Minimal schema for your new front-end
+@app.post("/chat")
+async def chat_api(payload: dict, request: Request):
+    """
+    Expects: {"message": "...", "history": [...]} (history is optional)
+    Returns: {"reply": "..."}
+    """
+    t0 = time.perf_counter()
+    message, history = _parse_chat_payload(payload)
+    # assignment selection parses PDFs/notebooks: keep it off the event loop
+    augmented_message = await asyncio.to_thread(_augment_with_assignment, message)
     
     try:
-        result = _shared_me.chat(augmented_message, history)
+        result = await _shared_me.achat(augmented_message, history, question=message)
         reply = result if isinstance(result, str) else str(result)
     except Exception as e:
         import traceback
@@ -776,4 +1657,37 @@ async def chat_api(payload: dict, request: Request):
         print(f"[ERROR] Traceback: {traceback.format_exc()}", flush=True)
         reply = f"Sorry, something went wrong: {e}"
     
+    metrics.CHAT_SECONDS.observe(time.perf_counter() - t0, "chat")
     return JSONResponse({"reply": reply})
+
+@app.post("/chat/stream")
+async def chat_stream_api(payload: dict):
+    """
+    Expects the same body as /chat. Streams NDJSON, one event per line:
+      {"type": "tool", "name": "..."}       a tool call started
+      {"type": "token", "text": "..."}      answer text delta
+      {"type": "replace", "reply": "..."}   reviewer rewrote the streamed draft
+      {"type": "done", "reply": "..."}      final answer (always last on success)
+      {"type": "error", "message": "..."}
+    """
+    t0 = time.perf_counter()
+    message, history = _parse_chat_payload(payload)
+    augmented_message = await asyncio.to_thread(_augment_with_assignment, message)
+
+    async def events():
+        try:
+            async for ev in _shared_me.achat_stream(augmented_message, history, question=message):
+                yield json.dumps(ev, ensure_ascii=False) + "\n"
+        except Exception as e:
+            import traceback
+            print(f"[ERROR] /chat/stream endpoint error: {e}", flush=True)
+            print(f"[ERROR] Traceback: {traceback.format_exc()}", flush=True)
+            yield json.dumps({"type": "error", "message": f"Sorry, something went wrong: {e}"}) + "\n"
+        finally:
+            metrics.CHAT_SECONDS.observe(time.perf_counter() - t0, "stream")
+
+    return StreamingResponse(
+        events(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,141 @@
+"""Binary, memory-mapped store of KB chunk texts (replaces store.jsonl).
+
+Layout of a store file (little-endian, all arrays 8-byte aligned):
+
+    header   magic b"VMCHUNK1", n, n_sources, blob_len, sources_len  (u64 each)
+    ids      int64[n]       chunk ids, ascending
+    offsets  uint64[n + 1]  byte ranges of each chunk in blob
+    source   uint32[n]      index into the sources table
+    blob     UTF-8 text of all chunks, back to back
+    sources  JSON list of sources: a path, or [path, other paths...] for a
+             chunk that also appears (near-duplicated) in other files
+
+Opening a store maps the file and wraps the arrays as zero-copy numpy views;
+a lookup binary-searches the ids and decodes just that chunk. Pages are
+shared between processes through the OS page cache, so load time and
+resident memory don't grow with the number of chunks.
+"""
+import json, mmap, os, struct
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"VMCHUNK1"
+HEADER = struct.Struct("<8s4Q")
+
+
+def write_chunk_store(path: str, rows: Iterable[Tuple[int, str, object]]) -> int:
+    """Write (id, chunk, source) rows, ids strictly ascending, to path; returns the row count.
+
+    source is a path or a sequence of paths (primary first).
+
+    Text is streamed to a side file so only the ids/offsets arrays are held in
+    memory. Writes path + ".tmp" first and renames it into place.
+    """
+    ids, offsets, src_idx = [], [0], []
+    sources, source_pos = [], {}
+    blob_path = path + ".blob.tmp"
+    last = None
+    with open(blob_path, "wb") as blob:
+        for cid, chunk, source in rows:
+            if last is not None and cid <= last:
+                raise ValueError(f"chunk ids must be ascending ({cid} after {last})")
+            last = cid
+            data = chunk.encode("utf-8")
+            blob.write(data)
+            ids.append(cid)
+            offsets.append(offsets[-1] + len(data))
+            if not isinstance(source, str):
+                source = tuple(source) if len(source) > 1 else source[0]
+            if source not in source_pos:
+                source_pos[source] = len(sources)
+                sources.append(source if isinstance(source, str) else list(source))
+            src_idx.append(source_pos[source])
+    n = len(ids)
+    src_json = json.dumps(sources, ensure_ascii=False).encode("utf-8")
+    try:
+        with open(path + ".tmp", "wb") as f:
+            f.write(HEADER.pack(MAGIC, n, len(sources), offsets[-1], len(src_json)))
+            f.write(np.asarray(ids, dtype="<i8").tobytes())
+            f.write(np.asarray(offsets, dtype="<u8").tobytes())
+            u32 = np.asarray(src_idx, dtype="<u4").tobytes()
+            f.write(u32 + b"\0" * (-len(u32) % 8))
+            with open(blob_path, "rb") as blob:
+                while True:
+                    block = blob.read(1 << 20)
+                    if not block:
+                        break
+                    f.write(block)
+            f.write(src_json)
+        os.replace(path + ".tmp", path)
+    finally:
+        os.remove(blob_path)
+        if os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+    return n
+
+
+class ChunkStore:
+    """Read-only view of a store file; behaves like a {id: {"id", "chunk", "source"[, "also"]}} mapping."""
+
+    def __init__(self, path: str, use_mmap: bool = True):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if not use_mmap:
+                self._mm = f.read()  # e.g. Windows, where a mapped file can't be replaced
+            elif size:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._mm = None
+        if self._mm is None or size < HEADER.size:
+            raise ValueError(f"{path}: not a chunk store (empty or truncated)")
+        magic, n, n_sources, blob_len, src_len = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a chunk store (bad magic)")
+        pos = HEADER.size
+        self.ids = np.frombuffer(self._mm, dtype="<i8", count=n, offset=pos)
+        pos += 8 * n
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=n + 1, offset=pos)
+        pos += 8 * (n + 1)
+        self._src = np.frombuffer(self._mm, dtype="<u4", count=n, offset=pos)
+        pos += 4 * n + (-(4 * n) % 8)
+        self._blob_start = pos
+        pos += blob_len
+        if pos + src_len != size:
+            raise ValueError(f"{path}: size mismatch (truncated or partially written)")
+        self.sources = json.loads(self._mm[pos:pos + src_len].decode("utf-8"))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _pos(self, cid) -> Optional[int]:
+        i = int(np.searchsorted(self.ids, cid))
+        return i if i < len(self.ids) and self.ids[i] == cid else None
+
+    def __contains__(self, cid) -> bool:
+        return self._pos(cid) is not None
+
+    def _row(self, i: int) -> dict:
+        a, b = int(self._offsets[i]), int(self._offsets[i + 1])
+        chunk = self._mm[self._blob_start + a:self._blob_start + b].decode("utf-8")
+        src = self.sources[self._src[i]]
+        if isinstance(src, str):
+            return {"id": int(self.ids[i]), "chunk": chunk, "source": src}
+        return {"id": int(self.ids[i]), "chunk": chunk, "source": src[0], "also": src[1:]}
+
+    def __getitem__(self, cid) -> dict:
+        i = self._pos(cid)
+        if i is None:
+            raise KeyError(cid)
+        return self._row(i)
+
+    def get(self, cid, default=None):
+        i = self._pos(cid)
+        return default if i is None else self._row(i)
+
+    def rows(self) -> Iterator[Tuple[int, str, str]]:
+        """All (id, chunk, primary source) rows in id order, decoded lazily."""
+        for i in range(len(self.ids)):
+            r = self._row(i)
+            yield r["id"], r["chunk"], r["source"]
@@ -0,0 +1,192 @@
+"""Token-budgeted prompt assembly for Me's chat turns.
+
+The system prompt is built once and reused verbatim, so every request shares
+the same prefix (what provider-side prompt caching keys on). Everything that
+varies per turn gets its own budget: client-supplied history keeps the most
+recent messages that fit, tool results (mostly retrieved KB passages) are cut
+passage by passage, and the assignment text attached by the "/kb/..." chips is
+truncated before it is added to the message.
+"""
+import json, os, re
+from typing import List, Optional
+
+try:
+    import tiktoken  # exact token counts when available
+except Exception:
+    tiktoken = None
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "16000"))
+CONTEXT_HISTORY_TOKENS = int(os.getenv("CONTEXT_HISTORY_TOKENS", "3000"))
+CONTEXT_TOOL_TOKENS = int(os.getenv("CONTEXT_TOOL_TOKENS", "5000"))
+CONTEXT_ASSIGNMENT_TOKENS = int(os.getenv("CONTEXT_ASSIGNMENT_TOKENS", "1000"))
+
+MESSAGE_OVERHEAD = 4  # role / separators per chat message
+TRIM_MARK = " …[trimmed]"
+# rag_search joins "[source] chunk" passages with blank lines
+PASSAGE_SPLIT_RE = re.compile(r"\n\n(?=\[[^\]\n]+\] )")
+
+_ENCODINGS = {}
+_ESTIMATE_NOTED = False
+
+def _estimate_note(reason: str):
+    global _ESTIMATE_NOTED
+    if not _ESTIMATE_NOTED:
+        _ESTIMATE_NOTED = True
+        print(f"[CTX] {reason}: token counts are estimated at ~4 chars/token", flush=True)
+
+def _encoding(model: Optional[str]):
+    if tiktoken is None:
+        _estimate_note("tiktoken not installed")
+        return None
+    if model not in _ENCODINGS:
+        try:
+            _ENCODINGS[model] = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            try:
+                _ENCODINGS[model] = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                _ENCODINGS[model] = None  # e.g. offline and no cached BPE file
+                _estimate_note("tiktoken encoding unavailable")
+    return _ENCODINGS[model]
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Token count of text; exact with tiktoken, otherwise ~4 chars/token (logged once).
+
+    The one token counter of the app: KB embedding batches (embeddings.py) and
+    rag_search packing (rag_pack.py) use it too.
+    """
+    if not text:
+        return 0
+    enc = _encoding(model)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """text cut to at most max_tokens (marked as trimmed), or unchanged if it fits."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    keep = max(0, max_tokens - count_tokens(TRIM_MARK, model))
+    enc = _encoding(model)
+    if enc is not None:
+        return enc.decode(enc.encode(text, disallowed_special=())[:keep]) + TRIM_MARK
+    return text[:keep * 4] + TRIM_MARK
+
+
+class TurnContext:
+    """The message list for one chat turn plus its token accounting."""
+
+    def __init__(self, assembler: "ContextAssembler", messages: List[dict], tokens: dict, dropped: int):
+        self.assembler = assembler
+        self.messages = messages
+        self.tokens = tokens
+        self.dropped_history = dropped
+        self.tool_budget = min(assembler.tool_tokens,
+                               max(0, assembler.max_tokens - sum(tokens.values())))
+
+    def add_assistant(self, msg: dict):
+        self.messages.append(msg)
+        self.tokens["assistant"] += MESSAGE_OVERHEAD + self.assembler.count(msg.get("content") or "") + \
+            sum(self.assembler.count(tc["function"]["arguments"]) for tc in msg.get("tool_calls") or [])
+
+    def tool_share(self, n: int) -> int:
+        """Tokens each of n tool results gets from what is left of the tool budget."""
+        remaining = max(0, self.tool_budget - self.tokens["tools"])
+        return max(remaining // max(1, n), 64)
+
+    def add_tool_results(self, results: List[dict]):
+        """Append tool messages, sharing what is left of the tool budget between them."""
+        share = self.tool_share(len(results))
+        for res in results:
+            content = self.assembler.fit_tool_result(res["content"], share)
+            self.messages.append({**res, "content": content})
+            self.tokens["tools"] += MESSAGE_OVERHEAD + self.assembler.count(content)
+
+    @property
+    def total(self) -> int:
+        return sum(self.tokens.values())
+
+    def report(self) -> str:
+        t = self.tokens
+        return (f"[CTX] prompt ~{self.total} tokens: system {t['system']}, history {t['history']}"
+                f" ({self.dropped_history} msgs dropped), user {t['user']}, tools {t['tools']}/{self.tool_budget},"
+                f" assistant {t['assistant']}")
+
+
+class ContextAssembler:
+    def __init__(
+        self,
+        system_prompt: str,
+        model: Optional[str] = None,
+        max_tokens: int = CONTEXT_MAX_TOKENS,
+        history_tokens: int = CONTEXT_HISTORY_TOKENS,
+        tool_tokens: int = CONTEXT_TOOL_TOKENS,
+    ):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.history_tokens = history_tokens
+        self.tool_tokens = tool_tokens
+        # the static prefix: one dict reused by every turn, counted once
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.system_tokens = MESSAGE_OVERHEAD + self.count(system_prompt)
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def start(self, message: str, history) -> TurnContext:
+        """Messages for a new turn: system prefix, the history that fits, the user message."""
+        user = {"role": "user", "content": message}
+        user_tokens = MESSAGE_OVERHEAD + self.count(message)
+        budget = min(self.history_tokens,
+                     max(0, self.max_tokens - self.system_tokens - user_tokens - self.tool_tokens))
+        kept, used = self.fit_history(history, budget)
+        tokens = {"system": self.system_tokens, "history": used, "user": user_tokens, "tools": 0, "assistant": 0}
+        return TurnContext(self, [self.system_message, *kept, user], tokens, len(history or []) - len(kept))
+
+    def fit_history(self, history, budget: int):
+        """Most recent user/assistant messages within budget, oldest first; returns (messages, tokens)."""
+        kept, used = [], 0
+        for m in reversed(history or []):
+            if not isinstance(m, dict) or m.get("role") not in ("user", "assistant"):
+                continue
+            content = m.get("content")
+            if not isinstance(content, str) or not content:
+                continue  # e.g. Gradio file/component messages
+            cost = MESSAGE_OVERHEAD + self.count(content)
+            if used + cost > budget:
+                if kept or budget - used <= MESSAGE_OVERHEAD + 16:
+                    break
+                # the latest message alone is over budget: keep its beginning
+                content = truncate_to_tokens(content, budget - used - MESSAGE_OVERHEAD, self.model)
+                cost = MESSAGE_OVERHEAD + self.count(content)
+            kept.append({"role": m["role"], "content": content})
+            used += cost
+        kept.reverse()
+        return kept, used
+
+    def fit_tool_result(self, content: str, budget: int) -> str:
+        """Shrink a JSON tool result to budget: drop the lowest-ranked passages / results first."""
+        if self.count(content) <= budget:
+            return content
+        try:
+            data = json.loads(content)
+        except ValueError:
+            return truncate_to_tokens(content, budget, self.model)
+        if isinstance(data, dict) and isinstance(data.get("context"), str):
+            passages = PASSAGE_SPLIT_RE.split(data["context"])
+            room = budget - self.count(json.dumps({"context": ""}))
+            kept, used = [], 0
+            for p in passages:
+                cost = self.count(p) + 1
+                if used + cost > room:
+                    if not kept:
+                        kept.append(truncate_to_tokens(p, room, self.model))
+                    break
+                kept.append(p)
+                used += cost
+            data["context"] = "\n\n".join(kept)
+        elif isinstance(data, dict) and isinstance(data.get("results"), list):
+            while len(data["results"]) > 1 and self.count(json.dumps(data, ensure_ascii=False)) > budget:
+                data["results"].pop()
+        out = json.dumps(data, ensure_ascii=False)
+        return out if self.count(out) <= budget else truncate_to_tokens(out, budget, self.model)
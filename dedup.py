@@ -0,0 +1,121 @@
+"""Near-duplicate detection for KB chunks: MinHash signatures + LSH banding.
+
+A chunk's signature is the minimum of `num_perm` random (multiply-shift)
+hash functions over its word 3-shingles; the fraction of equal signature entries estimates
+the Jaccard similarity of two chunks' shingle sets. Signatures are split into
+`bands` bands; chunks that agree on a whole band become candidates, which
+are then confirmed on the full signature (estimated Jaccard >= threshold).
+
+Existing chunks are loaded in bulk into per-band sorted arrays (binary search,
+no per-chunk Python objects); chunks added during a build go into a dict.
+"""
+import os, re, zlib
+from collections import defaultdict
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+KB_DEDUP = os.getenv("KB_DEDUP", "1") == "1"
+KB_DEDUP_THRESHOLD = float(os.getenv("KB_DEDUP_THRESHOLD", "0.85"))
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+SHINGLE = 3
+_SHINGLE_MIX = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9], dtype=np.uint64)
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """64-bit hash of every word 3-gram (one hash for texts shorter than that)."""
+    toks = TOKEN_RE.findall((text or "").casefold()) or [""]
+    t = np.fromiter((zlib.crc32(w.encode("utf-8")) for w in toks), dtype=np.uint64, count=len(toks))
+    if len(t) < SHINGLE:
+        t = np.pad(t, (0, SHINGLE - len(t)))
+    n = len(t) - SHINGLE + 1
+    return sum(t[i:i + n] * _SHINGLE_MIX[i] for i in range(SHINGLE))  # wraps mod 2^64
+
+
+class MinHashLSH:
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = KB_DEDUP_THRESHOLD, seed: int = 1):
+        assert num_perm % bands == 0
+        self.num_perm, self.bands, self.rows = num_perm, bands, num_perm // bands
+        self.threshold = threshold
+        rng = np.random.default_rng(seed)
+        # h -> (a*h + b) >> 32 mod 2^64, a odd: a multiply-shift hash family
+        self._a = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+        self._mix = rng.integers(1, 1 << 63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+        self._ids = np.empty(0, dtype=np.int64)           # bulk-loaded, sorted by id
+        self._sigs = np.empty((0, num_perm), dtype=np.uint32)
+        self._band_keys, self._band_rows = [], []          # per band: sorted keys, row numbers
+        self._new_sigs = {}                                # id -> signature, added this session
+        self._new_buckets = defaultdict(list)              # (band, key) -> ids
+
+    def signature(self, text: str) -> np.ndarray:
+        h = shingle_hashes(text)
+        return self._permute(h).min(axis=1)
+
+    def _permute(self, h: np.ndarray) -> np.ndarray:
+        """(num_perm, len(h)) hash values; laid out so per-text minima reduce contiguous rows."""
+        p = self._a[:, None] * h[None, :]
+        p += self._b[:, None]
+        p >>= np.uint64(32)
+        return p.astype(np.uint32)
+
+    def signatures(self, texts: Iterable[str], batch: int = 512) -> np.ndarray:
+        """Signatures of many texts; permutes all shingles of a batch at once, then min-reduces per text."""
+        texts = list(texts)
+        out = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for start in range(0, len(texts), batch):
+            hs = [shingle_hashes(t) for t in texts[start:start + batch]]
+            offsets = np.cumsum([0] + [len(h) for h in hs[:-1]])
+            perm = self._permute(np.concatenate(hs))
+            out[start:start + len(hs)] = np.minimum.reduceat(perm, offsets, axis=1).T
+        return out
+
+    def _keys(self, sigs: np.ndarray) -> np.ndarray:
+        """(n, bands) hash of each band of each signature."""
+        banded = sigs.astype(np.uint64).reshape(len(sigs), self.bands, self.rows)
+        return (banded * self._mix).sum(axis=2)  # wraps mod 2^64; only equality matters
+
+    def load(self, ids: Sequence[int], sigs: np.ndarray):
+        """Replace the bulk part with (ids, signatures) of already-indexed chunks."""
+        order = np.argsort(np.asarray(ids, dtype=np.int64), kind="stable")
+        self._ids = np.asarray(ids, dtype=np.int64)[order]
+        self._sigs = np.asarray(sigs, dtype=np.uint32)[order]
+        keys = self._keys(self._sigs)
+        self._band_rows = [np.argsort(keys[:, b], kind="stable") for b in range(self.bands)]
+        self._band_keys = [keys[rows, b] for b, rows in enumerate(self._band_rows)]
+
+    def add(self, cid: int, sig: np.ndarray):
+        self._new_sigs[cid] = sig
+        for b, key in enumerate(self._keys(sig[None, :])[0]):
+            self._new_buckets[(b, int(key))].append(cid)
+
+    def _sig_of(self, cid: int) -> Optional[np.ndarray]:
+        if cid in self._new_sigs:
+            return self._new_sigs[cid]
+        i = int(np.searchsorted(self._ids, cid))
+        return self._sigs[i] if i < len(self._ids) and self._ids[i] == cid else None
+
+    def query(self, sig: np.ndarray, exclude=frozenset()) -> Optional[int]:
+        """Id of the most similar stored chunk with estimated Jaccard >= threshold, or None."""
+        candidates = set()
+        for b, key in enumerate(self._keys(sig[None, :])[0]):
+            candidates.update(self._new_buckets.get((b, int(key)), ()))
+            if len(self._ids):
+                keys = self._band_keys[b]
+                lo, hi = np.searchsorted(keys, key, "left"), np.searchsorted(keys, key, "right")
+                candidates.update(int(self._ids[r]) for r in self._band_rows[b][lo:hi])
+        best, best_sim = None, self.threshold
+        for cid in candidates - set(exclude):
+            other = self._sig_of(cid)
+            sim = float(np.mean(other == sig)) if other is not None else 0.0
+            if sim >= best_sim:
+                best, best_sim = cid, sim
+        return best
+
+    def export(self, keep_ids: Iterable[int]):
+        """(ids, signatures) of every stored chunk in keep_ids, for saving."""
+        keep = set(keep_ids)
+        ids = [int(i) for i in self._ids if int(i) in keep] + [i for i in self._new_sigs if i in keep]
+        sigs = [self._sig_of(i) for i in ids]
+        return np.asarray(ids, dtype=np.int64), (np.vstack(sigs) if sigs else np.empty((0, self.num_perm), np.uint32))
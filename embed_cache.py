@@ -0,0 +1,145 @@
+"""Two-tier cache for query embeddings: in-memory LRU in front of SQLite.
+
+Keys are (model name, normalized text); vectors are stored as float32 blobs,
+so the disk tier survives restarts and is shared by worker processes.
+"""
+import os, sqlite3, threading, time, unicodedata
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "data/embed_cache.sqlite")
+EMBED_CACHE_MEM_ITEMS = int(os.getenv("EMBED_CACHE_MEM_ITEMS", "2048"))
+EMBED_CACHE_DISK_ITEMS = int(os.getenv("EMBED_CACHE_DISK_ITEMS", "100000"))
+
+
+def normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form used as the cache key."""
+    return " ".join(unicodedata.normalize("NFKC", text or "").casefold().split())
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        path: Optional[str] = EMBED_CACHE_PATH,
+        mem_items: int = EMBED_CACHE_MEM_ITEMS,
+        disk_items: int = EMBED_CACHE_DISK_ITEMS,
+    ):
+        self.mem_items = mem_items
+        self.disk_items = disk_items
+        self._mem: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._con = None
+        self._disk_rows = 0  # running estimate of the rows on disk, see _evict_disk
+        self._puts_since_count = 0
+        self.stats = {"mem_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._con = sqlite3.connect(path, check_same_thread=False)
+                self._con.execute("PRAGMA journal_mode=WAL;")
+                self._con.execute("PRAGMA synchronous=NORMAL;")
+                self._con.execute("""
+                CREATE TABLE IF NOT EXISTS emb(
+                  model TEXT NOT NULL,
+                  text TEXT NOT NULL,
+                  vec BLOB NOT NULL,
+                  last_used REAL NOT NULL,
+                  PRIMARY KEY (model, text)
+                );""")
+                self._con.execute("CREATE INDEX IF NOT EXISTS emb_last_used ON emb(last_used);")
+                self._con.commit()
+                (self._disk_rows,) = self._con.execute("SELECT COUNT(*) FROM emb").fetchone()
+            except sqlite3.Error as e:
+                print(f"[EMB] Disk cache unavailable ({path}): {e}", flush=True)
+                self._con = None
+
+    def _mem_put(self, key: tuple, vec: np.ndarray):
+        self._mem[key] = vec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        key = (model, normalize_text(text))
+        with self._lock:
+            vec = self._mem.get(key)
+            if vec is not None:
+                self._mem.move_to_end(key)
+                self.stats["mem_hits"] += 1
+                return vec
+            if self._con is not None:
+                row = self._con.execute("SELECT vec FROM emb WHERE model = ? AND text = ?", key).fetchone()
+                if row is not None:
+                    vec = np.frombuffer(row[0], dtype="float32")
+                    self._con.execute("UPDATE emb SET last_used = ? WHERE model = ? AND text = ?",
+                                      (time.time(), *key))
+                    self._con.commit()
+                    self._mem_put(key, vec)
+                    self.stats["disk_hits"] += 1
+                    return vec
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, model: str, text: str, vec) -> np.ndarray:
+        key = (model, normalize_text(text))
+        vec = np.asarray(vec, dtype="float32")
+        vec.setflags(write=False)  # shared between callers
+        with self._lock:
+            self._mem_put(key, vec)
+            if self._con is not None:
+                self._con.execute("INSERT OR REPLACE INTO emb(model, text, vec, last_used) VALUES (?,?,?,?)",
+                                  (*key, vec.tobytes(), time.time()))
+                self._evict_disk()
+                self._con.commit()
+        return vec
+
+    def _evict_disk(self):
+        # a running count instead of a COUNT(*) per put: every put counts as a new
+        # row (replacements are overcounted). The table is recounted past the cap,
+        # and every 1% of it in puts to pick up rows other processes added.
+        self._disk_rows += 1
+        self._puts_since_count += 1
+        if self._disk_rows <= self.disk_items and self._puts_since_count < max(1, self.disk_items // 100):
+            return
+        (n,) = self._con.execute("SELECT COUNT(*) FROM emb").fetchone()
+        self._disk_rows, self._puts_since_count = n, 0
+        if n <= self.disk_items:
+            return
+        # drop the least recently used rows plus ~10% headroom so we don't evict on every put
+        extra = n - self.disk_items + max(1, self.disk_items // 10)
+        self._con.execute("""
+          DELETE FROM emb WHERE rowid IN (
+            SELECT rowid FROM emb ORDER BY last_used ASC LIMIT ?
+          );""", (extra,))
+        self._disk_rows = max(0, n - extra)
+        self.stats["evictions"] += extra
+
+    def embed(
+        self,
+        model: str,
+        texts: Sequence[str],
+        embed_fn: Callable[[List[str]], Sequence[Sequence[float]]],
+    ) -> List[np.ndarray]:
+        """Return vectors for texts, calling embed_fn once for all cache misses."""
+        out: List[Optional[np.ndarray]] = [self.get(model, t) for t in texts]
+        missing = [i for i, v in enumerate(out) if v is None]
+        if missing:
+            vecs = embed_fn([texts[i] for i in missing])
+            for i, v in zip(missing, vecs):
+                out[i] = self.put(model, texts[i], v)
+        return out
+
+    def hit_rate(self) -> float:
+        hits = self.stats["mem_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            if self._con is not None:
+                self._con.execute("DELETE FROM emb")
+                self._con.commit()
+                self._disk_rows = self._puts_since_count = 0
@@ -0,0 +1,217 @@
+"""Batched, concurrent embedding requests for KB ingestion.
+
+`embed_texts` in app.py sends its whole input in one request, which is fine
+for a query but not for a corpus: providers cap inputs per request (items and
+tokens), and one serial request caps throughput. This module packs texts into
+batches under both limits, runs a bounded number of batches at once, retries
+rate-limit / transient errors with backoff, and yields float32 matrices as
+batches complete so callers can stream them straight into a FAISS index.
+
+It also defines the embedding backends app.py chooses between
+(EMBEDDINGS_BACKEND): `OpenAIEmbeddings` (the API, as above) and
+`HashingEmbeddings`, an in-process feature-hashing vectorizer that needs no
+network and embeds a query in well under a millisecond. A backend's `name` is
+recorded in the KB manifest; vectors from different backends never mix.
+"""
+import os, random, re, time, zlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+from context_budget import count_tokens
+
+try:
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+    RETRYABLE_ERRORS: tuple = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+except Exception:
+    RETRYABLE_ERRORS = ()
+
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "60000"))
+EMBED_BATCH_ITEMS = int(os.getenv("EMBED_BATCH_ITEMS", "256"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+EMBED_HASH_DIM = int(os.getenv("EMBED_HASH_DIM", "1024"))
+
+def pack_batches(
+    texts: Sequence[str],
+    max_tokens: int = EMBED_BATCH_TOKENS,
+    max_items: int = EMBED_BATCH_ITEMS,
+) -> List[Tuple[int, int]]:
+    """Split texts into contiguous [start, end) ranges under the token and item limits.
+
+    A single text larger than max_tokens gets a batch of its own.
+    """
+    batches = []
+    start, tokens = 0, 0
+    for i, text in enumerate(texts):
+        n = count_tokens(text)
+        if i > start and (tokens + n > max_tokens or i - start >= max_items):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += n
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+def _retry_after(err) -> float:
+    response = getattr(err, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", ""))
+    except (TypeError, ValueError):
+        return 0.0
+
+def _embed_batch(client, model: str, batch: Sequence[str], max_retries: int) -> np.ndarray:
+    delay = 0.5
+    for attempt in range(max_retries + 1):
+        try:
+            t0 = time.perf_counter()
+            resp = client.embeddings.create(model=model, input=list(batch))
+            metrics.EMBED_SECONDS.observe(time.perf_counter() - t0, "openai")
+            metrics.EMBED_INPUTS.labels("openai").inc(len(batch))
+            # the API may return items out of order; "index" is authoritative
+            data = sorted(resp.data, key=lambda d: d.index)
+            return np.asarray([d.embedding for d in data], dtype="float32")
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            metrics.EMBED_RETRIES.labels("openai", type(e).__name__).inc()
+            wait_s = (_retry_after(e) or delay) * (1 + random.random() * 0.25)
+            print(f"[EMB] {type(e).__name__}; retrying batch of {len(batch)} in {wait_s:.1f}s "
+                  f"({attempt + 1}/{max_retries})", flush=True)
+            time.sleep(wait_s)
+            delay = min(delay * 2, 30.0)
+
+def iter_embedding_batches(
+    client,
+    model: str,
+    texts: Sequence[str],
+    max_tokens: int = EMBED_BATCH_TOKENS,
+    max_items: int = EMBED_BATCH_ITEMS,
+    concurrency: int = EMBED_CONCURRENCY,
+    max_retries: int = EMBED_MAX_RETRIES,
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """Embed texts in batches, yielding (start_offset, float32 matrix) as each batch completes.
+
+    Batches complete out of order; rows of a yielded matrix correspond to
+    texts[start_offset:start_offset + len(matrix)]. At most `concurrency`
+    requests are in flight at once.
+    """
+    batches = pack_batches(texts, max_tokens, max_items)
+    if not batches:
+        return
+    concurrency = max(1, concurrency)
+    pending_batches = iter(batches)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as pool:
+        in_flight = {}
+
+        def submit_next() -> bool:
+            nxt = next(pending_batches, None)
+            if nxt is None:
+                return False
+            start, end = nxt
+            in_flight[pool.submit(_embed_batch, client, model, texts[start:end], max_retries)] = start
+            return True
+
+        for _ in range(concurrency):
+            if not submit_next():
+                break
+        try:
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    start = in_flight.pop(fut)
+                    yield start, fut.result()
+                    submit_next()
+        finally:
+            for fut in in_flight:
+                fut.cancel()
+
+
+class OpenAIEmbeddings:
+    """Embeddings from the OpenAI API; `get_client` returns the (late-bound) client."""
+    local = False
+
+    def __init__(self, model: str, get_client: Callable):
+        self.model = model
+        self.name = model  # manifests written before backends existed store the bare model name
+        self._get_client = get_client
+
+    def available(self) -> bool:
+        return self._get_client() is not None
+
+    def _client(self):
+        client = self._get_client()
+        if client is None:
+            raise RuntimeError("OpenAI client not set. Call set_client(me.openai) at startup.")
+        return client
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """One request for a few texts (queries); corpora go through iter_batches."""
+        t0 = time.perf_counter()
+        resp = self._client().embeddings.create(model=self.model, input=list(texts))
+        metrics.EMBED_SECONDS.observe(time.perf_counter() - t0, "openai")
+        metrics.EMBED_INPUTS.labels("openai").inc(len(texts))
+        return np.asarray([d.embedding for d in sorted(resp.data, key=lambda d: d.index)], dtype="float32")
+
+    def iter_batches(self, texts: Sequence[str]) -> Iterator[Tuple[int, np.ndarray]]:
+        return iter_embedding_batches(self._client(), self.model, texts)
+
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbeddings:
+    """Local bag-of-words vectors: hashed, signed unigram + bigram counts (log-scaled).
+
+    Each n-gram is hashed (crc32, stable across processes) to one of `dim`
+    buckets with a +/-1 sign, which is a sparse random projection of the
+    n-gram counts; the per-text sums are one bincount over the whole batch.
+    Lexical rather than semantic, but deterministic and free.
+    """
+    local = True
+
+    def __init__(self, dim: int = EMBED_HASH_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def available(self) -> bool:
+        return True
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        t0 = time.perf_counter()
+        mat = self._embed(texts)
+        metrics.EMBED_SECONDS.observe(time.perf_counter() - t0, "hashing")
+        metrics.EMBED_INPUTS.labels("hashing").inc(len(texts))
+        return mat
+
+    def _embed(self, texts: Sequence[str]) -> np.ndarray:
+        hashes, counts = [], []
+        for text in texts:
+            toks = TOKEN_RE.findall((text or "").casefold())
+            grams = toks + [f"{a} {b}" for a, b in zip(toks, toks[1:])]
+            hashes.extend(zlib.crc32(g.encode("utf-8")) for g in grams)
+            counts.append(len(grams))
+        h = np.asarray(hashes, dtype=np.int64)
+        rows = np.repeat(np.arange(len(texts)), counts)
+        signs = np.where(h & (1 << 31), -1.0, 1.0)
+        mat = np.bincount(rows * self.dim + h % self.dim, weights=signs,
+                          minlength=len(texts) * self.dim).reshape(len(texts), self.dim)
+        mat = np.sign(mat) * np.log1p(np.abs(mat))
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        return (mat / np.where(norms == 0, 1.0, norms)).astype("float32")
+
+    def iter_batches(self, texts: Sequence[str], batch: int = 4096) -> Iterator[Tuple[int, np.ndarray]]:
+        for start in range(0, len(texts), batch):
+            yield start, self.embed(texts[start:start + batch])
+
+
+def make_backend(kind: str, model: str, get_client: Callable):
+    """Backend for EMBEDDINGS_BACKEND ("openai" or "hashing")."""
+    if kind == "hashing":
+        return HashingEmbeddings()
+    if kind != "openai":
+        print(f"[EMB] Unknown EMBEDDINGS_BACKEND {kind!r}; using openai", flush=True)
+    return OpenAIEmbeddings(model, get_client)
@@ -0,0 +1,136 @@
+"""In-memory catalog of KB files, bucketed for constant-time random picks.
+
+One `os.walk` builds the catalog; files are grouped by (top-level folder,
+extension) and, for assignment-looking files, by extension. Staleness is
+checked by stat-ing the directories seen in the last walk (a directory's
+mtime changes when entries are added, removed or renamed), at most once per
+`check_interval_s`, so requests never list directories in the common case.
+"""
+import os, random, threading, time
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+KB_CATALOG_CHECK_S = float(os.getenv("KB_CATALOG_CHECK_S", "5"))
+
+
+class _Snapshot:
+    def __init__(self):
+        self.files: List[str] = []  # paths relative to the KB root, "/"-separated
+        self.by_folder_ext: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+        self.assignments_by_ext: Dict[str, List[str]] = defaultdict(list)
+        self.dir_mtimes: Dict[str, int] = {}
+
+
+class KBCatalog:
+    def __init__(
+        self,
+        root: str,
+        exts: Sequence[str],
+        assignment_keywords: Sequence[str],
+        assignment_exts: Sequence[str],
+        check_interval_s: float = KB_CATALOG_CHECK_S,
+    ):
+        self.root = root
+        self.exts = tuple(e.lower() for e in exts)
+        self.assignment_keywords = tuple(assignment_keywords)
+        self.assignment_exts = tuple(e.lower() for e in assignment_exts)
+        self.check_interval_s = check_interval_s
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._snap = self._scan()
+
+    def _ext(self, name: str) -> Optional[str]:
+        ext = os.path.splitext(name)[1].lower()
+        return ext if ext in self.exts else None
+
+    def _scan(self) -> _Snapshot:
+        snap = _Snapshot()
+        for dirpath, dirnames, filenames in os.walk(self.root, followlinks=True):
+            try:
+                snap.dir_mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+            except OSError:
+                continue
+            dirnames.sort()
+            rel_dir = os.path.relpath(dirpath, self.root).replace("\\", "/")
+            rel_dir = "" if rel_dir == "." else rel_dir
+            top = rel_dir.split("/", 1)[0]
+            for name in sorted(filenames):
+                ext = self._ext(name)
+                if ext is None:
+                    continue
+                rel = f"{rel_dir}/{name}" if rel_dir else name
+                snap.files.append(rel)
+                snap.by_folder_ext[(top, ext)].append(rel)
+                low = rel.lower()
+                if low.endswith(self.assignment_exts) and any(k in low for k in self.assignment_keywords):
+                    snap.assignments_by_ext[ext].append(rel)
+        return snap
+
+    def _is_stale(self, snap: _Snapshot) -> bool:
+        if not snap.dir_mtimes:
+            return os.path.isdir(self.root)
+        for d, mtime in snap.dir_mtimes.items():
+            try:
+                if os.stat(d).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def snapshot(self) -> _Snapshot:
+        """Current snapshot, rescanning first if a directory changed since the last walk."""
+        now = time.monotonic()
+        if now - self._checked < self.check_interval_s:
+            return self._snap
+        with self._lock:
+            if now - self._checked >= self.check_interval_s:
+                if self._is_stale(self._snap):
+                    self._snap = self._scan()
+                    print(f"[KB] Catalog refreshed ({len(self._snap.files)} files)", flush=True)
+                self._checked = time.monotonic()
+        return self._snap
+
+    def files(self) -> List[str]:
+        return list(self.snapshot().files)
+
+    def pick(
+        self,
+        folders: Optional[Sequence[str]] = None,
+        exts: Optional[Sequence[str]] = None,
+        rng: random.Random = random,
+    ) -> Optional[str]:
+        """Uniformly random relative path among matching files, or None.
+
+        With folders, the first folder that has any match wins (files under
+        that top-level folder / path prefix); without, assignment-looking
+        files anywhere. exts restricts the extensions.
+        """
+        snap = self.snapshot()
+        exts = tuple(e.lower() for e in exts) if exts else None
+        if folders:
+            for folder in folders:
+                norm = folder.strip().strip("/").replace("\\", "/")
+                top = norm.split("/", 1)[0]
+                buckets = [files for (t, e), files in snap.by_folder_ext.items()
+                           if (not norm or t == top) and (exts is None or e in exts)]
+                if "/" in norm:
+                    buckets = [[f for f in files if f.startswith(norm)] for files in buckets]
+                chosen = _pick_from(buckets, rng)
+                if chosen:
+                    return chosen
+            return None
+        buckets = [files for e, files in snap.assignments_by_ext.items() if exts is None or e in exts]
+        return _pick_from(buckets, rng)
+
+
+def _pick_from(buckets: List[List[str]], rng) -> Optional[str]:
+    """Uniform pick across several lists without concatenating them."""
+    total = sum(len(b) for b in buckets)
+    if not total:
+        return None
+    i = rng.randrange(total)
+    for b in buckets:
+        if i < len(b):
+            return b[i]
+        i -= len(b)
+    return None
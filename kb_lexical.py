@@ -0,0 +1,89 @@
+"""Lexical (BM25) index over the KB chunks, kept next to the FAISS index.
+
+An SQLite FTS5 table keyed by chunk id (rowid = FAISS id), indexing each
+chunk's text and its source path, so course codes and folder names match too.
+KB builds add and remove the same ids they embed or drop; rag_search fuses
+its ranking with the vector one. Queries go through the same term handling
+as QADB lookups (stopwords dropped, AND first, then OR over the rarest terms).
+"""
+import os, sqlite3, threading
+from typing import Iterable, List, Tuple
+
+from qadb import fts_query, rarest_terms
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+  chunk, source,
+  tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_terms USING fts5vocab(chunks, 'row');
+"""
+SEARCH_SQL = """
+  SELECT rowid, -bm25(chunks) AS score
+  FROM chunks
+  WHERE chunks MATCH ?
+  ORDER BY rank
+  LIMIT ?;
+"""
+COLUMNS = "{chunk source}"
+
+
+class KBLexicalIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()  # one writer (KB builds are serialized anyway)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        con = self._connect()
+        con.executescript(SCHEMA)
+        con.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL;")
+        con.execute("PRAGMA synchronous=NORMAL;")
+        con.execute("PRAGMA busy_timeout=5000;")
+        return con
+
+    def _reader(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = self._connect()
+        return con
+
+    def count(self) -> int:
+        return self._reader().execute("SELECT count(*) FROM chunks").fetchone()[0]
+
+    def update(self, add: Iterable[Tuple[int, str, str]] = (), remove: Iterable[int] = (), replace: bool = False):
+        """Apply (id, chunk, source) additions and id removals in one transaction; replace clears first."""
+        with self._lock:
+            con = self._connect()
+            try:
+                with con:
+                    if replace:
+                        con.execute("DELETE FROM chunks")
+                    con.executemany("DELETE FROM chunks WHERE rowid = ?", ((int(i),) for i in remove))
+                    con.executemany("INSERT INTO chunks(rowid, chunk, source) VALUES (?, ?, ?)", add)
+                if replace:
+                    con.execute("INSERT INTO chunks(chunks) VALUES ('optimize')")
+            finally:
+                con.close()
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[int, float]]:
+        """Best-matching chunk ids as (id, score), higher score = better."""
+        q = fts_query(query, column=COLUMNS)
+        if q is None:
+            return []
+        con = self._reader()
+        rows = con.execute(SEARCH_SQL, (q, limit)).fetchall()
+        if not rows:
+            terms = rarest_terms(query, lambda t: self._doc_freq(con, t))
+            if not terms:
+                return []
+            rows = con.execute(SEARCH_SQL, (fts_query(query, column=COLUMNS, any_term=True, terms=terms), limit)).fetchall()
+        return rows
+
+    @staticmethod
+    def _doc_freq(con: sqlite3.Connection, term: str) -> int:
+        row = con.execute("SELECT doc FROM chunks_terms WHERE term = ?", (term.lower(),)).fetchone()
+        return row[0] if row else 0
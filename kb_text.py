@@ -0,0 +1,214 @@
+"""Text extraction for KB files (PDF, notebooks, plain text).
+
+Kept free of import-time side effects (no .env loading, clients or servers),
+so the fork server (or spawned workers) can import it cheaply. `iter_extracted` runs the
+CPU-heavy formats on a process pool with a bounded number of files in flight
+and yields results as they finish; a file that fails or times out becomes an
+error result instead of stopping the build.
+"""
+import multiprocessing, os, queue, time
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Tuple
+
+from text_cache import file_key
+
+try:
+    import nbformat  # for .ipynb
+except Exception:
+    nbformat = None
+
+KB_EXTRACT_WORKERS = int(os.getenv("KB_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+KB_EXTRACT_TIMEOUT_S = float(os.getenv("KB_EXTRACT_TIMEOUT_S", "120"))
+# forkserver where available: builds run on app.py's warm-up thread next to the
+# server loop and the QADB writer, and a plain fork would copy their locks
+# mid-use. Workers fork from a single-threaded server that has only this module
+# (and pypdf) imported, so they also start faster than spawned ones.
+KB_EXTRACT_START = os.getenv(
+    "KB_EXTRACT_START", "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+FORKSERVER_PRELOAD = [__name__, "pypdf"]
+
+# formats worth a worker process; everything else is read inline
+HEAVY_EXTS = (".pdf", ".ipynb")
+
+
+def _pdf_text_and_pages(path: str) -> Tuple[str, int]:
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    chunks = []
+    for p in reader.pages:
+        t = p.extract_text() or ""
+        if t.strip():
+            chunks.append(t)
+    return "\n".join(chunks), len(reader.pages)
+
+def _ipynb_text(path: str) -> str:
+    nb = nbformat.read(path, as_version=4)
+    parts = []
+    for cell in nb.cells:
+        if cell.cell_type == "markdown":
+            parts.append(cell.source)
+        elif cell.cell_type == "code":
+            # keep code lightly—useful for RAG but don’t over-index
+            parts.append("```code\n" + cell.source + "\n```")
+    return "\n\n".join(parts)
+
+def read_pdf_text(path: str) -> str:
+    try:
+        return _pdf_text_and_pages(path)[0]
+    except Exception as e:
+        print(f"[KB] PDF read failed {path}: {e}")
+        return ""
+
+def read_ipynb_text(path: str) -> str:
+    if nbformat is None:
+        print("[KB] nbformat not installed; skipping .ipynb:", path)
+        return ""
+    try:
+        return _ipynb_text(path)
+    except Exception as e:
+        print(f"[KB] ipynb read failed {path}: {e}")
+        return ""
+
+def read_plain_text(path: str) -> str:
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            return f.read()
+    except Exception as e:
+        print(f"[KB] text read failed {path}: {e}")
+        return ""
+
+def read_any_to_text(fp: str) -> str:
+    low = fp.lower()
+    if low.endswith(".pdf"):
+        return read_pdf_text(fp)
+    if low.endswith(".ipynb"):
+        return read_ipynb_text(fp)
+    # .md, .txt, .r, .rmd, .py → plain text
+    return read_plain_text(fp)
+
+
+@dataclass
+class Extracted:
+    path: str
+    text: str = ""
+    pages: int = 0  # PDF pages (0 for other formats)
+    error: Optional[str] = None
+    timed_out: bool = False
+    seconds: float = 0.0
+
+
+def extract(fp: str) -> Extracted:
+    """Extract one file, reporting failures in the result instead of raising."""
+    t0 = time.perf_counter()
+    out = Extracted(fp)
+    try:
+        low = fp.lower()
+        if low.endswith(".pdf"):
+            out.text, out.pages = _pdf_text_and_pages(fp)
+        elif low.endswith(".ipynb"):
+            if nbformat is None:
+                raise RuntimeError("nbformat not installed")
+            out.text = _ipynb_text(fp)
+        else:
+            with open(fp, "r", encoding="utf-8", errors="ignore") as f:
+                out.text = f.read()
+    except Exception as e:
+        out.error = f"{type(e).__name__}: {e}"
+    out.seconds = time.perf_counter() - t0
+    return out
+
+
+def iter_extracted(
+    paths: Iterable[str],
+    workers: int = KB_EXTRACT_WORKERS,
+    timeout_s: float = KB_EXTRACT_TIMEOUT_S,
+    cache=None,
+) -> Iterator[Extracted]:
+    """Yield an `Extracted` for every path, in completion order.
+
+    PDFs and notebooks go to a pool of `workers` processes, one file per
+    worker in flight (the next is submitted as a result is consumed, so a
+    slow consumer throttles extraction); other files are read inline. A file
+    still running after `timeout_s` is reported as an error and the pool is
+    replaced, so a hung or crashed parser cannot stall the rest. `workers=0`
+    extracts everything inline.
+
+    With a `text_cache.TextCache`, files whose current version is cached are
+    not parsed again, and successful extractions are added to it.
+    """
+    paths = list(paths)
+    if cache is not None:
+        keys, misses = {}, []
+        for fp in paths:
+            try:
+                keys[fp] = file_key(fp)
+            except OSError:
+                misses.append(fp)
+                continue
+            hit = cache.get(keys[fp])
+            if hit is not None:
+                yield Extracted(fp, text=hit[0], pages=hit[1])
+            else:
+                misses.append(fp)
+        for res in iter_extracted(misses, workers, timeout_s):
+            if not res.error and res.path in keys:
+                cache.put(keys[res.path], res.text, res.pages)
+            yield res
+        return
+    heavy = [p for p in paths if workers > 0 and p.lower().endswith(HEAVY_EXTS)]
+    heavy_set = set(heavy)
+    for fp in paths:
+        if fp not in heavy_set:
+            yield extract(fp)
+    if not heavy:
+        return
+
+    workers = min(workers, len(heavy))
+    ctx = multiprocessing.get_context(KB_EXTRACT_START)
+    if KB_EXTRACT_START == "forkserver":
+        ctx.set_forkserver_preload(FORKSERVER_PRELOAD)
+    done_q: "queue.Queue[Extracted]" = queue.Queue()
+    pending = iter(heavy)
+    in_flight = {}  # path -> deadline
+    pool = ctx.Pool(workers)
+
+    def submit(fp: str):
+        in_flight[fp] = time.monotonic() + timeout_s
+        pool.apply_async(extract, (fp,), callback=done_q.put,
+                         error_callback=lambda e, fp=fp: done_q.put(Extracted(fp, error=repr(e))))
+
+    try:
+        for _ in range(workers):
+            submit(next(pending))
+        while in_flight:
+            wait_s = max(0.0, min(in_flight.values()) - time.monotonic())
+            try:
+                res = done_q.get(timeout=wait_s + 0.05)
+            except queue.Empty:
+                now = time.monotonic()
+                expired = [fp for fp, deadline in in_flight.items() if deadline <= now]
+                if not expired:
+                    continue
+                for fp in expired:
+                    del in_flight[fp]
+                    yield Extracted(fp, error=f"timed out after {timeout_s:.0f}s", timed_out=True, seconds=timeout_s)
+                # the stuck worker can't be cancelled alone: replace the pool, requeue the rest
+                pool.terminate()
+                pool = ctx.Pool(workers)
+                for fp in list(in_flight):
+                    submit(fp)
+                while len(in_flight) < workers:
+                    nxt = next(pending, None)
+                    if nxt is None:
+                        break
+                    submit(nxt)
+                continue
+            if res.path not in in_flight:
+                continue  # late result for a file that already timed out
+            del in_flight[res.path]
+            yield res
+            nxt = next(pending, None)
+            if nxt is not None:
+                submit(nxt)
+    finally:
+        pool.terminate()
@@ -0,0 +1,181 @@
+"""Per-stage latency histograms and counters, served as Prometheus text on /metrics.
+
+A small in-process registry instead of prometheus_client: recording is a
+dict lookup, a bisect and a locked add, a few microseconds per observation
+next to model calls that take hundreds of milliseconds. Counters that
+already live elsewhere (cache stats) are read only when /metrics is scraped,
+via `CallbackMetric`.
+
+    with metrics.TOOL_SECONDS.time(name):
+        ...
+    metrics.LLM_TOKENS.labels("answer", "prompt").inc(usage.prompt_tokens)
+"""
+import bisect, threading, time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    return "+Inf" if v == float("inf") else repr(float(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._child())
+        return child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines += self._samples(key, child)
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self, key, child):
+        return [f"{self.name}_total{_labels(self.labelnames, key)} {_num(child.value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # per bucket; the last one is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float, *labels):
+        self.labels(*labels).observe(value)
+
+    def time(self, *labels):
+        return self.labels(*labels).time()
+
+    def _samples(self, key, child):
+        with child._lock:
+            counts, total = list(child.counts), child.sum
+        lines, cumulative = [], 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            le = 'le="%s"' % _num(bound)
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(total)}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Counter or gauge whose values come from fn() -> {label values tuple: value} at scrape time."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str], fn: Callable[[], dict], kind: str = "counter"):
+        super().__init__(name, help, labelnames)
+        self.kind, self._fn = kind, fn
+
+    def render(self) -> List[str]:
+        suffix = "_total" if self.kind == "counter" else ""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            values = self._fn()
+        except Exception as e:
+            return lines + [f"# {self.name} unavailable: {_escape(str(e))}"]
+        for key, v in sorted(values.items()):
+            lines.append(f"{self.name}{suffix}{_labels(self.labelnames, key)} {_num(v)}")
+        return lines
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format (0.0.4)."""
+    return "\n".join(line for m in list(REGISTRY) for line in m.render()) + "\n"
+
+
+# ---- the app's metrics ----
+CHAT_SECONDS = Histogram("virtualme_chat_seconds", "Whole chat turn, request to final answer.", ["endpoint"])
+LLM_SECONDS = Histogram("virtualme_llm_request_seconds",
+                        "One chat.completions call (streamed: until the last chunk).", ["purpose"])
+LLM_FIRST_TOKEN_SECONDS = Histogram("virtualme_llm_first_token_seconds",
+                                    "Streamed chat.completions: time to the first chunk.", ["purpose"])
+LLM_TOKENS = Counter("virtualme_llm_tokens", "Tokens reported by the API.", ["purpose", "type"])
+TOOL_SECONDS = Histogram("virtualme_tool_seconds", "One tool call.", ["tool"])
+TOOL_CALLS = Counter("virtualme_tool_calls", "Tool calls by outcome.", ["tool", "status"])
+EMBED_SECONDS = Histogram("virtualme_embedding_seconds",
+                          "One successful embedding call: an API request, or a local hashing batch.", ["backend"])
+EMBED_INPUTS = Counter("virtualme_embedding_inputs", "Texts embedded successfully.", ["backend"])
+EMBED_RETRIES = Counter("virtualme_embedding_retries", "Embedding requests retried after a transient error.",
+                        ["backend", "error"])
+RAG_SECONDS = Histogram("virtualme_rag_search_seconds", "One rag_search call, all queries included.", ["mode"])
+FAISS_SECONDS = Histogram("virtualme_faiss_search_seconds", "One (batched) FAISS index search.")
+QADB_SECONDS = Histogram("virtualme_qadb_seconds", "One QADB operation.", ["op"])
@@ -0,0 +1,257 @@
+"""SQLite storage for the reusable Q&A database (QADB).
+
+The schema is created once per process. Reads use one long-lived connection
+per thread (sqlite3 keeps a per-connection cache of prepared statements), and
+all writes go through a single writer thread that groups concurrent upserts
+into one transaction, so N simultaneous saves cost one commit instead of N.
+
+Questions are deduplicated on a hash of their normalized text (unique index),
+so saving the same question again updates its answer. `qa_fts` is an
+external-content FTS5 index over `qa`, kept in sync by triggers, with prefix
+indexes for type-ahead.
+"""
+import hashlib, os, queue, re, sqlite3, threading
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+
+from embed_cache import normalize_text
+
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS qa(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  question TEXT NOT NULL,
+  answer TEXT NOT NULL,
+  tags TEXT,
+  created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+  qhash TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS qa_qhash ON qa(qhash);
+CREATE VIRTUAL TABLE IF NOT EXISTS qa_fts USING fts5(
+  question, answer, tags, content='qa', content_rowid='id',
+  tokenize = 'unicode61 remove_diacritics 2',
+  prefix = '2 3 4'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS qa_fts_terms USING fts5vocab(qa_fts, 'row');
+CREATE TRIGGER IF NOT EXISTS qa_ai AFTER INSERT ON qa BEGIN
+  INSERT INTO qa_fts(rowid, question, answer, tags) VALUES (new.id, new.question, new.answer, new.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS qa_ad AFTER DELETE ON qa BEGIN
+  INSERT INTO qa_fts(qa_fts, rowid, question, answer, tags) VALUES ('delete', old.id, old.question, old.answer, old.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS qa_au AFTER UPDATE ON qa BEGIN
+  INSERT INTO qa_fts(qa_fts, rowid, question, answer, tags) VALUES ('delete', old.id, old.question, old.answer, old.tags);
+  INSERT INTO qa_fts(rowid, question, answer, tags) VALUES (new.id, new.question, new.answer, new.tags);
+END;
+"""
+
+# bm25 is "lower is better"; callers get score = -bm25 (higher is better)
+LOOKUP_FTS_SQL = """
+  SELECT question, answer, tags, -bm25(qa_fts) AS score
+  FROM qa_fts
+  WHERE qa_fts MATCH ?
+  ORDER BY rank
+  LIMIT ?;
+"""
+TERM_DOCS_SQL = "SELECT doc FROM qa_fts_terms WHERE term = ?"
+LOOKUP_EXACT_SQL = "SELECT question, answer, tags, NULL FROM qa WHERE qhash = ?"
+# newest first: FTS5 walks rowids in order and stops at LIMIT instead of scoring every match
+SUGGEST_SQL = """
+  SELECT question
+  FROM qa_fts
+  WHERE qa_fts MATCH ?
+  ORDER BY rowid DESC
+  LIMIT ?;
+"""
+UPSERT_SQL = """
+  INSERT INTO qa(question, answer, tags, qhash) VALUES (?, ?, ?, ?)
+  ON CONFLICT(qhash) DO UPDATE SET
+    question = excluded.question,
+    answer = excluded.answer,
+    tags = excluded.tags,
+    created_at = CURRENT_TIMESTAMP
+  RETURNING id;
+"""
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+MAX_OR_TERMS = 3
+# words that match most questions: they cost a lot to rank and barely change it
+STOPWORDS = frozenset("""
+a an and are as at be by can could did do does for from had has have how i in is it me my of on or
+should so that the this to was were what when where which who why will with would you your
+""".split())
+
+
+def question_hash(question: str) -> str:
+    """Dedup key: case/whitespace-insensitive, ignoring trailing punctuation."""
+    norm = normalize_text(question).rstrip(" ?!.")
+    return hashlib.sha1(norm.encode("utf-8")).hexdigest()
+
+def query_terms(text: str, prefix_last: bool = False) -> List[str]:
+    """Words of a query minus stopwords (all of them if nothing else is left)."""
+    tokens = TOKEN_RE.findall(text or "")
+    if not tokens:
+        return []
+    last = tokens[-1]
+    kept = [t for t in tokens[:-1] if t.lower() not in STOPWORDS]
+    if prefix_last or last.lower() not in STOPWORDS:
+        kept.append(last)
+    return kept or tokens
+
+def rarest_terms(text: str, doc_freq: Callable[[str], int], n: int = MAX_OR_TERMS) -> List[str]:
+    """The n query terms found in the fewest rows, for an OR fallback query.
+
+    Words found in no row (typos, unknown words) are dropped first: they would
+    otherwise count as the rarest and crowd out the words that can match.
+    """
+    df = {t: doc_freq(t) for t in dict.fromkeys(query_terms(text))}
+    return sorted((t for t, d in df.items() if d > 0), key=df.get)[:n]
+
+def fts_query(text: str, column: str = "{question tags}", any_term: bool = False,
+              prefix_last: bool = False, terms: Optional[List[str]] = None) -> Optional[str]:
+    """Build a MATCH expression from free text, or None if it has no words.
+
+    Each word is quoted so user text can't break FTS syntax. Terms are ANDed
+    (or ORed with any_term). Lookups match questions and tags only: answers
+    are long and would match almost anything.
+    """
+    terms = [f'"{t}"' for t in (terms if terms is not None else query_terms(text, prefix_last))]
+    if not terms:
+        return None
+    if prefix_last:
+        terms[-1] += "*"
+    return f"{column} : ({(' OR ' if any_term else ' ').join(terms)})"
+
+MAX_WRITE_BATCH = 128
+
+
+class QADBStore:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._writes: "queue.Queue[Tuple[tuple, Future]]" = queue.Queue()
+        con = self._connect()
+        self._migrate(con)
+        con.close()
+        self._writer = threading.Thread(target=self._write_loop, name="qadb-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, check_same_thread=False, cached_statements=64)
+        con.execute("PRAGMA journal_mode=WAL;")
+        con.execute("PRAGMA synchronous=NORMAL;")
+        con.execute("PRAGMA busy_timeout=5000;")
+        return con
+
+    @staticmethod
+    def _migrate(con: sqlite3.Connection):
+        (version,) = con.execute("PRAGMA user_version").fetchone()
+        if version >= SCHEMA_VERSION:
+            return
+        has_qa = con.execute("SELECT 1 FROM sqlite_master WHERE name = 'qa'").fetchone()
+        if has_qa:
+            # v1: no qhash column and a contentless qa_fts that could not return text
+            cols = [r[1] for r in con.execute("PRAGMA table_info(qa)")]
+            with con:
+                if "qhash" not in cols:
+                    con.execute("ALTER TABLE qa ADD COLUMN qhash TEXT")
+                rows = con.execute("SELECT id, question FROM qa ORDER BY id").fetchall()
+                latest = {}
+                for rid, q in rows:
+                    latest[question_hash(q)] = rid
+                keep = set(latest.values())
+                dupes = [(rid,) for rid, _ in rows if rid not in keep]
+                con.executemany("DELETE FROM qa WHERE id = ?", dupes)
+                con.executemany("UPDATE qa SET qhash = ? WHERE id = ?", [(h, rid) for h, rid in latest.items()])
+                con.execute("DROP TABLE IF EXISTS qa_fts")
+            print(f"[QADB] Migrated schema to v{SCHEMA_VERSION} ({len(dupes)} duplicate questions removed)", flush=True)
+        con.executescript(SCHEMA)
+        with con:
+            con.execute("INSERT INTO qa_fts(qa_fts) VALUES ('rebuild')")
+            con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _reader(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = self._connect()
+        return con
+
+    # ---- reads ----
+    def lookup(self, question: str, fuzzy: bool = True, limit: int = 5) -> List[tuple]:
+        """Top matches as (question, answer, tags, score); exact mode matches the normalized question."""
+        con = self._reader()
+        if not fuzzy:
+            return con.execute(LOOKUP_EXACT_SQL, (question_hash(question),)).fetchall()
+        query = fts_query(question)
+        if query is None:
+            return []
+        rows = con.execute(LOOKUP_FTS_SQL, (query, limit)).fetchall()
+        if not rows:
+            # nothing has every word: rank partial matches on the rarest few, which is
+            # what bm25 weighs anyway, so common words don't make us score half the table
+            terms = rarest_terms(question, lambda t: self._doc_freq(con, t))
+            if not terms:
+                return []
+            rows = con.execute(LOOKUP_FTS_SQL, (fts_query(question, any_term=True, terms=terms), limit)).fetchall()
+        return rows
+
+    @staticmethod
+    def _doc_freq(con: sqlite3.Connection, term: str) -> int:
+        row = con.execute(TERM_DOCS_SQL, (term.lower(),)).fetchone()
+        return row[0] if row else 0
+
+    def suggest(self, prefix: str, limit: int = 8) -> List[str]:
+        """Type-ahead: stored questions matching the typed words, last word as a prefix."""
+        query = fts_query(prefix, column="question", prefix_last=True)
+        if query is None:
+            return []
+        return [q for (q,) in self._reader().execute(SUGGEST_SQL, (query, limit))]
+
+    def recent(self, limit: int) -> List[Tuple[int, str, str, float]]:
+        """Newest rows as (id, question, answer, created_at unix seconds)."""
+        return self._reader().execute("""
+          SELECT id, question, answer, CAST(strftime('%s', created_at) AS REAL)
+          FROM qa ORDER BY id DESC LIMIT ?;
+        """, (limit,)).fetchall()
+
+    # ---- writes ----
+    def upsert(self, question: str, answer: str, tags: Optional[str] = None, wait: bool = True):
+        """Queue a save for the writer thread; returns the row id (or a Future if wait=False).
+
+        Saving a question that is already stored (after normalization) replaces its answer.
+        """
+        fut: Future = Future()
+        self._writes.put(((question, answer, tags), fut))
+        return fut.result() if wait else fut
+
+    def _write_loop(self):
+        con = self._connect()
+        while True:
+            batch = [self._writes.get()]
+            # group whatever else is already waiting into the same transaction
+            while len(batch) < MAX_WRITE_BATCH:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with con:
+                    rowids = [self._insert(con, *row) for row, _ in batch]
+                for (_, fut), rowid in zip(batch, rowids):
+                    fut.set_result(rowid)
+            except Exception:
+                # one bad row must not fail its neighbours: retry one transaction each
+                for row, fut in batch:
+                    try:
+                        with con:
+                            fut.set_result(self._insert(con, *row))
+                    except Exception as e:
+                        fut.set_exception(e)
+
+    @staticmethod
+    def _insert(con: sqlite3.Connection, question: str, answer: str, tags: Optional[str]) -> int:
+        # triggers keep qa_fts in sync
+        (rowid,) = con.execute(UPSERT_SQL, (question, answer, tags, question_hash(question))).fetchone()
+        return rowid
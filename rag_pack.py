@@ -0,0 +1,78 @@
+"""Diversity-aware selection and packing of retrieved KB passages.
+
+rag_search gathers more candidates than it returns. `mmr_order` reranks them
+with maximal marginal relevance: each pick maximizes
+``lam * relevance - (1 - lam) * max similarity to the passages already
+picked``, computed for all candidates at once with NumPy. `pack` then walks
+that order and keeps passages until k are chosen or the token budget is used
+up, with at most `per_source` passages from any one file.
+"""
+import os
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from context_budget import count_tokens
+
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+RAG_MAX_PER_SOURCE = int(os.getenv("RAG_MAX_PER_SOURCE", "3"))
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "3000"))
+
+
+def mmr_order(relevance: np.ndarray, vectors: Optional[np.ndarray], lam: float = RAG_MMR_LAMBDA) -> List[int]:
+    """Candidate positions in MMR order.
+
+    relevance: (n,) positive scores, higher is better (scaled to a max of 1 here).
+    vectors: (n, d) L2-normalized candidate vectors, or None to rank by
+    relevance alone.
+    """
+    n = len(relevance)
+    if n == 0:
+        return []
+    rel = np.asarray(relevance, dtype="float32")
+    top = float(np.abs(rel).max())
+    rel = rel / top if top > 0 else np.ones(n, dtype="float32")
+    if vectors is None or lam >= 1.0:
+        return [int(i) for i in np.argsort(-rel, kind="stable")]
+    sims = vectors @ vectors.T
+    redundancy = np.full(n, -np.inf, dtype="float32")  # max similarity to anything picked so far
+    picked = np.zeros(n, dtype=bool)
+    order = []
+    for _ in range(n):
+        score = lam * rel - (1.0 - lam) * np.where(np.isfinite(redundancy), redundancy, 0.0)
+        score[picked] = -np.inf
+        best = int(np.argmax(score))
+        order.append(best)
+        picked[best] = True
+        redundancy = np.maximum(redundancy, sims[best])
+    return order
+
+
+def pack(
+    order: Sequence[int],
+    sources: Sequence[str],
+    texts: Sequence[str],
+    k: int,
+    budget_tokens: int = RAG_CONTEXT_TOKENS,
+    per_source: int = RAG_MAX_PER_SOURCE,
+    count: Optional[Callable[[str], int]] = None,
+) -> List[int]:
+    """Positions to keep, in order: at most k, per_source per file, within budget_tokens.
+
+    The first passage is always kept (its text is cut later by the context
+    budget if it alone is too long).
+    """
+    count = count or count_tokens
+    kept, used, per = [], 0, {}
+    for i in order:
+        if len(kept) >= k:
+            break
+        if per.get(sources[i], 0) >= per_source:
+            continue
+        cost = count(texts[i])
+        if kept and used + cost > budget_tokens:
+            continue  # a shorter passage further down may still fit
+        kept.append(i)
+        used += cost
+        per[sources[i]] = per.get(sources[i], 0) + 1
+    return kept
@@ -0,0 +1,74 @@
+"""
+Recall@k vs latency of the KB index kinds (ann_index.py) against the exact
+flat index, on a synthetic clustered corpus of normalized vectors.
+
+    python scripts/bench_ann.py [--n 100000] [--dim 256] [--queries 500] [--k 10]
+"""
+import argparse, os, sys, time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ann_index
+
+
+def synthetic(n, dim, n_queries, seed=0):
+    """Vectors around a few thousand topic centers (like chunks of many documents)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(16, n // 50), dim)).astype("float32")
+    x = centers[rng.integers(len(centers), size=n)] + 0.6 * rng.standard_normal((n, dim)).astype("float32")
+    q = centers[rng.integers(len(centers), size=n_queries)] + 0.6 * rng.standard_normal((n_queries, dim)).astype("float32")
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    return x, q
+
+
+def timed_search(index, q, k):
+    # one query at a time, like rag_search
+    t0 = time.perf_counter()
+    found = np.vstack([index.search(q[i:i + 1], k)[1] for i in range(len(q))])
+    return found, (time.perf_counter() - t0) / len(q) * 1000
+
+
+def recall(found, truth):
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=100000)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--k", type=int, default=10)
+    args = ap.parse_args()
+
+    import faiss
+    x, q = synthetic(args.n, args.dim, args.queries)
+    ids = np.arange(args.n, dtype="int64") * 7  # sparse ids, as after incremental builds
+
+    exact = ann_index.build_index("flat", x, ids)
+    truth, flat_ms = timed_search(exact, q, args.k)
+    print(f"{args.n:,} vectors, dim {args.dim}, {args.queries} queries, recall@{args.k} vs exact")
+    print(f"{'index':<12} {'param':<14} {'build s':>8} {'ms/query':>9} {'recall':>7}")
+    print(f"{'flat':<12} {'-':<14} {'-':>8} {flat_ms:>9.3f} {1.0:>7.3f}")
+
+    for kind, knob, values in (("ivf", "nprobe", (1, 4, 16, 64)),
+                               ("ivfpq", "nprobe", (4, 16, 64)),
+                               ("hnsw", "efSearch", (16, 64, 256))):
+        t0 = time.perf_counter()
+        index = ann_index.build_index(kind, x, ids)
+        build_s = time.perf_counter() - t0
+        for v in values:
+            if knob == "nprobe":
+                faiss.extract_index_ivf(index).nprobe = v
+            else:
+                faiss.downcast_index(index.index).hnsw.efSearch = v
+            found, ms = timed_search(index, q, args.k)
+            print(f"{kind:<12} {f'{knob}={v}':<14} {build_s:>8.1f} {ms:>9.3f} {recall(found, truth):>7.3f}")
+    print(f"\nauto policy would pick: {ann_index.choose_kind(args.n, 'auto')}")
+
+
+if __name__ == "__main__":
+    main()
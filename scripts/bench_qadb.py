@@ -0,0 +1,117 @@
+"""
+Micro-benchmark: QADB lookup / upsert throughput, QADBStore vs the previous
+open-a-connection-per-call code path (reproduced below as legacy_*).
+Note the legacy lookup ran against a contentless FTS table, so its rows came
+back with NULL question/answer text.
+
+    python scripts/bench_qadb.py [--rows 2000] [--lookups 2000] [--threads 8]
+"""
+import argparse, os, random, sqlite3, sys, tempfile, threading, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from qadb import QADBStore
+
+WORDS = ("clustering regression python numpy faiss dama assignment project pandas sql "
+         "linear algebra probability statistics gradient descent kmeans pca rlhf").split()
+
+
+# ---- previous implementation (one connection + schema DDL per call) ----
+def legacy_conn(path):
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode=WAL;")
+    con.execute("PRAGMA synchronous=NORMAL;")
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS qa(
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      question TEXT NOT NULL,
+      answer TEXT NOT NULL,
+      tags TEXT,
+      created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );""")
+    con.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS qa_fts USING fts5(
+      question, answer, tags, content='',
+      tokenize = 'unicode61 remove_diacritics 2'
+    );""")
+    return con
+
+def legacy_lookup(path, question, limit=5):
+    con = legacy_conn(path); cur = con.cursor()
+    try:
+        cur.execute("""
+          SELECT question, answer, tags FROM qa_fts WHERE qa_fts MATCH ?
+          ORDER BY bm25(qa_fts) ASC LIMIT ?;""", (f'"{question}"', limit))
+    except sqlite3.OperationalError:
+        cur.execute("""
+          SELECT question, answer, tags FROM qa_fts WHERE qa_fts MATCH ?
+          ORDER BY bm25(qa_fts) ASC LIMIT ?;""", (question, limit))
+    rows = cur.fetchall(); con.close()
+    return rows
+
+def legacy_upsert(path, question, answer, tags=None):
+    con = legacy_conn(path); cur = con.cursor()
+    cur.execute("INSERT INTO qa(question,answer,tags) VALUES (?,?,?)", (question, answer, tags))
+    cur.execute("INSERT INTO qa_fts(rowid, question, answer, tags) VALUES (last_insert_rowid(), ?, ?, ?)",
+                (question, answer, tags))
+    con.commit(); con.close()
+
+
+def sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+def timed(fn, n_ops, threads=1):
+    per_thread = n_ops // threads
+    def work():
+        for _ in range(per_thread):
+            fn()
+    t0 = time.perf_counter()
+    pool = [threading.Thread(target=work) for _ in range(threads)]
+    for t in pool: t.start()
+    for t in pool: t.join()
+    elapsed = time.perf_counter() - t0
+    return per_thread * threads / elapsed
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=2000)
+    ap.add_argument("--lookups", type=int, default=2000)
+    ap.add_argument("--threads", type=int, default=8)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_qadb_")
+    legacy_path = os.path.join(tmp, "legacy.sqlite")
+    store = QADBStore(os.path.join(tmp, "store.sqlite"))
+    rng = random.Random(0)
+    qa = [(sentence(rng, 8), sentence(rng, 60)) for _ in range(args.rows)]
+    it_legacy, it_store = iter(qa), iter(qa)
+    lock = threading.Lock()
+
+    def nxt(it):
+        with lock:
+            return next(it)
+
+    results = []
+    n_serial = args.rows // 2
+    n_conc = args.rows - n_serial
+    results.append(("upsert, 1 thread", timed(lambda: legacy_upsert(legacy_path, *nxt(it_legacy)), n_serial),
+                    timed(lambda: store.upsert(*nxt(it_store)), n_serial)))
+    results.append((f"upsert, {args.threads} threads",
+                     timed(lambda: legacy_upsert(legacy_path, *nxt(it_legacy)), n_conc, args.threads),
+                     timed(lambda: store.upsert(*nxt(it_store)), n_conc, args.threads)))
+
+    queries = [sentence(rng, 2) for _ in range(256)]
+    q = lambda: rng.choice(queries)
+    results.append(("lookup, 1 thread", timed(lambda: legacy_lookup(legacy_path, q()), args.lookups),
+                    timed(lambda: store.lookup(q()), args.lookups)))
+    results.append((f"lookup, {args.threads} threads",
+                    timed(lambda: legacy_lookup(legacy_path, q()), args.lookups, args.threads),
+                    timed(lambda: store.lookup(q()), args.lookups, args.threads)))
+
+    print(f"{'operation':<20} {'legacy ops/s':>14} {'QADBStore ops/s':>16} {'speed-up':>9}")
+    for name, old, new in results:
+        print(f"{name:<20} {old:>14,.0f} {new:>16,.0f} {new / old:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
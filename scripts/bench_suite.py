@@ -0,0 +1,279 @@
+"""
+Offline benchmark suite for the chat and retrieval hot paths; writes JSON.
+
+Everything runs locally against the fake OpenAI server (fixed latency,
+canned rag_lookup tool calls, deterministic embeddings) on synthetic KBs
+from synth_kb.py. Each corpus size runs in a fresh process and scratch
+directory, so the real data/ and models/ are never touched.
+
+Measured:
+  kb.<size>:  full index build (chunks/s), no-op resync, index load,
+              rag_search latency for new queries (embedding round trip),
+              repeated queries (embedding cache hit) and keyword queries
+  chat:       /chat latency one at a time, and at each concurrency level
+  qadb:       qadb_upsert / qadb_lookup throughput, 1 and N threads (an upsert
+              has no answer-cache embedding: ANSWER_CACHE=0 for the run)
+
+    python scripts/bench_suite.py [--sizes 500,2000,8000] [--latency 0.02] [--out bench.json]
+    python scripts/bench_suite.py --baseline bench_old.json --out bench_new.json
+
+With --baseline the timings are compared metric by metric against an
+earlier run (changes beyond --tolerance are flagged). Only compare runs
+made with the same options on the same machine.
+"""
+import argparse, asyncio, atexit, json, os, platform, shutil, subprocess, sys, tempfile, threading, time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+import synth_kb
+
+
+def latency_stats(seconds) -> dict:
+    ms = np.asarray(seconds, dtype="float64") * 1000
+    return {"n": len(ms), "mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)), "max_ms": float(ms.max())}
+
+
+def timed_calls(fn, args) -> list:
+    out = []
+    for a in args:
+        t0 = time.perf_counter()
+        fn(a)
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+def throughput(fn, items, threads: int = 1) -> float:
+    """Calls per second of fn over items, split across threads."""
+    shards = [items[i::threads] for i in range(threads)]
+    def work(shard):
+        for it in shard:
+            fn(it)
+    pool = [threading.Thread(target=work, args=(s,)) for s in shards]
+    t0 = time.perf_counter()
+    for t in pool: t.start()
+    for t in pool: t.join()
+    return len(items) / (time.perf_counter() - t0)
+
+
+# ---- workers (one process each, inside a scratch directory) ----
+def _scratch(size: int, seed: int) -> str:
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    shutil.copytree(os.path.join(ROOT, "me"), os.path.join(workdir, "me"))
+    synth_kb.generate(os.path.join(workdir, "kb"), size, seed=seed)
+    os.chdir(workdir)
+    os.environ["KB_WARMUP"] = "off"
+    os.environ["GRADIO_UI"] = "0"
+    return workdir
+
+
+def worker_kb(args) -> dict:
+    _scratch(args.size, args.seed)
+    import app
+    t0 = time.perf_counter()
+    chunks = app.build_faiss_index(full=True)
+    build_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    app.build_faiss_index()
+    resync_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    index, meta = app.KB_INDEX.reload()
+    load_s = time.perf_counter() - t0
+
+    queries = synth_kb.queries(args.queries, seed=args.seed + 1)
+    keywords = [w for words in synth_kb.TOPICS.values() for w in words.split()][:args.queries]
+    search = lambda q: app.rag_search(q, args.k)
+    search("warm-up query")
+    return {
+        "chunks": chunks,
+        "index": app.ann_index.describe(index) if index is not None else "none",
+        "build_s": build_s,
+        "build_chunks_per_s": chunks / build_s,
+        "resync_s": resync_s,
+        "load_s": load_s,
+        "rag_search_new": latency_stats(timed_calls(search, queries)),
+        "rag_search_repeat": latency_stats(timed_calls(search, queries)),
+        "rag_search_keyword": latency_stats(timed_calls(search, keywords)),
+    }
+
+
+def worker_chat(args) -> dict:
+    _scratch(args.size, args.seed)
+    import httpx
+    import app
+    app.build_faiss_index(full=True)
+    result = {"chat": {}, "qadb": {}}
+
+    async def one(client, i):
+        t0 = time.perf_counter()
+        r = await client.post("/chat", json={"message": f"chat question {i} about kmeans clustering homework",
+                                             "history": []})
+        r.raise_for_status()
+        return time.perf_counter() - t0
+
+    async def run():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            await one(client, -1)  # warm-up (index load, connection pools)
+            n = 0
+            seq = []
+            for _ in range(args.chat_requests):
+                seq.append(await one(client, n)); n += 1
+            result["chat"]["sequential"] = latency_stats(seq)
+            for c in args.concurrency:
+                t0 = time.perf_counter()
+                lat = await asyncio.gather(*(one(client, n + i) for i in range(c)))
+                wall = time.perf_counter() - t0
+                n += c
+                result["chat"][f"concurrent_{c}"] = {**latency_stats(lat), "wall_s": wall,
+                                                     "requests_per_s": c / wall}
+    asyncio.run(run())
+
+    # QADB after /chat: its rows would otherwise feed the semantic answer cache
+    words = [w for words in synth_kb.TOPICS.values() for w in words.split()]
+    rng = np.random.default_rng(args.seed)
+    rows = [(" ".join(rng.choice(words, 8)) + f" {i}?", " ".join(rng.choice(words, 60)))
+            for i in range(args.qadb_ops)]
+    half = len(rows) // 2
+    lookups = [" ".join(rng.choice(words, 2)) for _ in range(args.qadb_ops)]
+    result["qadb"] = {
+        "upsert_per_s": throughput(lambda r: app.qadb_upsert(*r), rows[:half]),
+        f"upsert_{args.threads}_threads_per_s": throughput(lambda r: app.qadb_upsert(*r), rows[half:], args.threads),
+        "lookup_per_s": throughput(app.qadb_lookup, lookups),
+        f"lookup_{args.threads}_threads_per_s": throughput(app.qadb_lookup, lookups, args.threads),
+    }
+    return result
+
+
+# ---- driver ----
+def run_worker(kind: str, size: int, args, env: dict) -> dict:
+    fd, result_path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", kind, "--size", str(size),
+           "--result", result_path, "--seed", str(args.seed), "--k", str(args.k),
+           "--queries", str(args.queries), "--chat-requests", str(args.chat_requests),
+           "--concurrency", ",".join(map(str, args.concurrency)),
+           "--qadb-ops", str(args.qadb_ops), "--threads", str(args.threads)]
+    log = None if args.verbose else subprocess.DEVNULL
+    try:
+        subprocess.run(cmd, env=env, check=True, stdout=log, stderr=log)
+        with open(result_path, encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.remove(result_path)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def flatten(d: dict, prefix: str = "") -> dict:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}.{k}" if prefix else str(k)
+        if isinstance(v, dict):
+            out.update(flatten(v, key))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = v
+    return out
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> int:
+    """Print per-metric changes vs the baseline; returns the number of regressions."""
+    old, new = flatten(baseline["results"]), flatten(current["results"])
+    regressions = 0
+    print(f"\n{'metric':<52} {'baseline':>12} {'current':>12} {'change':>8}")
+    for key in sorted(old.keys() & new.keys()):
+        higher_better = key.endswith("per_s")
+        if not (higher_better or key.endswith("_ms") or key.endswith("_s")) or not old[key]:
+            continue
+        change = new[key] / old[key] - 1
+        worse = -change if higher_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        regressions += bool(flag)
+        print(f"{key:<52} {old[key]:>12.4g} {new[key]:>12.4g} {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="500,2000,8000", help="corpus sizes in chunks")
+    ap.add_argument("--latency", type=float, default=0.02, help="fake API seconds per request")
+    ap.add_argument("--dim", type=int, default=256, help="fake embedding dimension")
+    ap.add_argument("--k", type=int, default=8)
+    ap.add_argument("--queries", type=int, default=50)
+    ap.add_argument("--chat-requests", type=int, default=10)
+    ap.add_argument("--concurrency", default="4,16")
+    ap.add_argument("--qadb-ops", type=int, default=2000)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--baseline", help="earlier results JSON to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="relative change flagged as a regression")
+    ap.add_argument("--verbose", action="store_true", help="show the app's own log output")
+    ap.add_argument("--worker", choices=("kb", "chat"), help=argparse.SUPPRESS)
+    ap.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    ap.add_argument("--result", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    args.concurrency = [int(c) for c in str(args.concurrency).split(",") if c]
+
+    if args.worker:
+        result = worker_kb(args) if args.worker == "kb" else worker_chat(args)
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return 0
+
+    from fake_openai_server import start_server
+    srv = start_server(latency=args.latency, dim=args.dim)
+    env = {**os.environ, "OPENAI_BASE_URL": srv.base_url, "OPENAI_API_KEY": "fake",
+           "EMBEDDINGS_BACKEND": "openai", "PYTHONUNBUFFERED": "1",
+           # similar benchmark questions must not be answered from the semantic answer cache
+           "ANSWER_CACHE": "0"}
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    results = {"kb": {}}
+    for size in sizes:
+        print(f"[BENCH] KB with {size} chunks…", flush=True)
+        results["kb"][str(size)] = run_worker("kb", size, args, env)
+        r = results["kb"][str(size)]
+        print(f"[BENCH]   build {r['build_chunks_per_s']:,.0f} chunks/s, rag_search p50 "
+              f"{r['rag_search_new']['p50_ms']:.1f}ms new / {r['rag_search_repeat']['p50_ms']:.1f}ms repeat "
+              f"({r['index']})", flush=True)
+    print(f"[BENCH] /chat and QADB on the {sizes[0]}-chunk KB…", flush=True)
+    results.update(run_worker("chat", sizes[0], args, env))
+    chat = results["chat"]
+    print(f"[BENCH]   /chat p50 {chat['sequential']['p50_ms']:.0f}ms; "
+          + ", ".join(f"{c} concurrent: {chat[f'concurrent_{c}']['requests_per_s']:.1f} req/s"
+                      for c in args.concurrency), flush=True)
+    print(f"[BENCH]   QADB upsert {results['qadb']['upsert_per_s']:,.0f}/s, "
+          f"lookup {results['qadb']['lookup_per_s']:,.0f}/s", flush=True)
+    srv.shutdown()
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git": git_revision(),
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "cpus": os.cpu_count(),
+                 "options": {k: v for k, v in vars(args).items()
+                             if k not in ("worker", "size", "result", "out", "baseline", "verbose")}},
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[BENCH] Wrote {args.out}", flush=True)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
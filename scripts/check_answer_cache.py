@@ -0,0 +1,78 @@
+"""
+Check which /chat turns the semantic answer cache answers and saves.
+
+Runs the app in-process against the fake OpenAI server (evaluations always
+pass, so every eligible answer is auto-saved) and checks that:
+  - a first-turn question asked again is answered from the cache, with no model call,
+    also when the client repeats the message as the last history turn;
+  - a follow-up (non-empty history) is not saved, so a new visitor asking the
+    same words later gets a fresh answer instead of one that depended on
+    someone else's conversation.
+
+    python scripts/check_answer_cache.py
+"""
+import asyncio, os, shutil, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from fake_openai_server import start_server
+
+srv = start_server(dim=64)
+os.environ["OPENAI_BASE_URL"] = srv.base_url
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+os.environ["ANSWER_CACHE"] = "1"
+os.environ["QC_MODE"] = "inline"  # evaluate and save before the reply is returned
+# run from a scratch dir so the check never writes into the real data/ or models/
+WORKDIR = tempfile.mkdtemp(prefix="check_answer_cache_")
+shutil.copytree(os.path.join(ROOT, "me"), os.path.join(WORKDIR, "me"))
+os.chdir(WORKDIR)
+
+import httpx
+import app
+
+DAMA_TURNS = [
+    {"role": "user", "content": "Tell me about your DAMA data management course"},
+    {"role": "assistant", "content": "It covered governance, metadata and data quality."},
+]
+
+
+async def model_calls(client, message, history):
+    """Chat completions the app made to answer one /chat request."""
+    before = srv.stats["chat_requests"]
+    r = await client.post("/chat", json={"message": message, "history": history})
+    r.raise_for_status()
+    return srv.stats["chat_requests"] - before
+
+
+def check(ok: bool, what: str) -> bool:
+    print(("✓ " if ok else "✗ ") + what)
+    return ok
+
+
+async def main():
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+        first = "What did you study in your clustering course?"
+        await model_calls(client, first, [])
+        repeat = await model_calls(client, first, [])
+        echoed = await model_calls(client, first, [{"role": "user", "content": first}])
+
+        follow_up = "Which tools did you use for it?"
+        await model_calls(client, follow_up, DAMA_TURNS)
+        saved = [q for _, q, _, _ in app.QADB_STORE.recent(100)]
+        fresh = await model_calls(client, follow_up, [])
+
+    print("=" * 60)
+    results = [
+        check(repeat == 0, f"repeated first-turn question answered from the cache ({repeat} model calls)"),
+        check(echoed == 0, f"same question with itself as history answered from the cache ({echoed} model calls)"),
+        check(follow_up not in saved, "follow-up answer not saved to QADB"),
+        check(fresh > 0, f"new visitor's identical question reached the model ({fresh} model calls)"),
+    ]
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
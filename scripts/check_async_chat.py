@@ -0,0 +1,63 @@
+"""
+Check that /chat serves concurrent conversations instead of queueing them.
+
+Starts the fake OpenAI server with a fixed per-request latency, then fires N
+simultaneous /chat requests at the app (in-process, no network). With a
+non-blocking request path N requests finish in roughly the time of one.
+
+    python scripts/check_async_chat.py [N]
+"""
+import asyncio, os, shutil, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from fake_openai_server import start_server
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+LATENCY = 0.3
+
+srv = start_server(latency=LATENCY, dim=64)
+os.environ["OPENAI_BASE_URL"] = srv.base_url
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+# every request must reach the model: no semantic answer-cache hits between similar questions
+os.environ["ANSWER_CACHE"] = "0"
+# run from a scratch dir so the check never writes into the real data/ or models/
+WORKDIR = tempfile.mkdtemp(prefix="check_async_chat_")
+shutil.copytree(os.path.join(ROOT, "me"), os.path.join(WORKDIR, "me"))
+os.chdir(WORKDIR)
+
+import httpx
+import app
+
+
+async def one(client, i):
+    r = await client.post("/chat", json={"message": f"question {i} about clustering", "history": []})
+    r.raise_for_status()
+    return r.json()["reply"]
+
+
+async def main():
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+        await one(client, -1)  # warm-up (index load, connection pools)
+
+        t0 = time.perf_counter()
+        await one(client, 0)
+        single = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        replies = await asyncio.gather(*(one(client, i) for i in range(N)))
+        concurrent = time.perf_counter() - t0
+
+    print("=" * 60)
+    print(f"1 request:  {single:.2f}s")
+    print(f"{N} requests: {concurrent:.2f}s   (max in-flight at model server: {srv.stats['max_in_flight']})")
+    ok = len(replies) == N and concurrent < single * 2
+    print(("✓ " if ok else "✗ ") + f"{N} concurrent /chat requests took {concurrent / single:.1f}x a single one")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,68 @@
+"""
+Check the batched embedding pipeline against the local fake embeddings server.
+No network or API key needed:  python scripts/check_embed_pipeline.py
+"""
+import os, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+import numpy as np
+from openai import OpenAI
+
+from embeddings import iter_embedding_batches, pack_batches
+from fake_openai_server import fake_embedding, start_server
+
+failures = 0
+
+def check(ok: bool, label: str):
+    global failures
+    print(("✓ " if ok else "✗ ") + label)
+    if not ok:
+        failures += 1
+
+texts = [f"chunk {i} about clustering, regression and assignment {i % 17}" for i in range(1000)]
+
+print("=" * 60)
+print("Embedding pipeline check (fake server)")
+print("=" * 60)
+
+print("\n[1] Batch packing...")
+batches = pack_batches(texts, max_tokens=500, max_items=64)
+check(batches[0][0] == 0 and batches[-1][1] == len(texts), "batches cover all texts")
+check(all(a[1] == b[0] for a, b in zip(batches, batches[1:])), "batches are contiguous")
+check(all(end - start <= 64 for start, end in batches), "item limit respected")
+check(len(pack_batches(["x" * 10000], max_tokens=100)) == 1, "oversized text gets its own batch")
+
+print("\n[2] Order, limits and 429 retries...")
+srv = start_server(latency=0.02, dim=64, max_items=64, rate_limit_every=5)
+client = OpenAI(base_url=srv.base_url, api_key="fake", max_retries=0)
+out = np.zeros((len(texts), 64), dtype="float32")
+seen = 0
+for start, mat in iter_embedding_batches(client, "fake", texts, max_tokens=2000, max_items=64, concurrency=4):
+    out[start:start + len(mat)] = mat
+    seen += len(mat)
+expected = np.asarray([fake_embedding(t, 64) for t in texts], dtype="float32")
+check(seen == len(texts), f"received {seen}/{len(texts)} vectors")
+check(np.allclose(out, expected, atol=1e-6), "vectors land at the right offsets")
+check(srv.stats["rate_limited"] > 0, f"{srv.stats['rate_limited']} rate-limited requests were retried")
+check(srv.stats["max_in_flight"] <= 4, f"max in-flight requests = {srv.stats['max_in_flight']} (limit 4)")
+srv.shutdown()
+
+print("\n[3] Concurrency speed-up...")
+srv = start_server(latency=0.1, dim=64)
+client = OpenAI(base_url=srv.base_url, api_key="fake", max_retries=0)
+timings = {}
+for conc in (1, 8):
+    t0 = time.perf_counter()
+    for _ in iter_embedding_batches(client, "fake", texts[:512], max_items=32, concurrency=conc):
+        pass
+    timings[conc] = time.perf_counter() - t0
+    print(f"  concurrency={conc}: {timings[conc]:.2f}s for 16 batches")
+check(timings[8] < timings[1] / 3, "8 concurrent batches are >3x faster than serial")
+srv.shutdown()
+
+print("\n" + "=" * 60)
+print("All checks passed." if not failures else f"{failures} check(s) failed.")
+sys.exit(1 if failures else 0)
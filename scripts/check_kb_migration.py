@@ -0,0 +1,67 @@
+"""
+Check that an index saved before the chunk store is served after an upgrade.
+
+Writes the old layout (index.faiss + store.jsonl, no chunks.bin) with the
+local hashing embeddings, starts the app with KB_WARMUP=off (so nothing but
+the first search touches the index) and checks that rag_search finds the
+chunks and that store.jsonl was converted in place, without a rebuild.
+
+    python scripts/check_kb_migration.py
+"""
+import json, os, shutil, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+os.environ["EMBEDDINGS_BACKEND"] = "hashing"
+os.environ["KB_WARMUP"] = "off"
+os.environ["GRADIO_UI"] = "0"
+# run from a scratch dir so the check never writes into the real data/ or models/
+WORKDIR = tempfile.mkdtemp(prefix="check_kb_migration_")
+shutil.copytree(os.path.join(ROOT, "me"), os.path.join(WORKDIR, "me"))
+os.chdir(WORKDIR)
+
+import faiss
+from embeddings import HashingEmbeddings
+
+CHUNKS = [
+    ("kmeans assigns each point to the nearest centroid", "ml/clustering.md"),
+    ("ridge regression adds an l2 penalty to the coefficients", "ml/regression.md"),
+    ("data governance defines stewardship and lineage", "notes/governance.md"),
+]
+
+
+def write_legacy_layout(faiss_dir: str):
+    os.makedirs(faiss_dir)
+    vecs = HashingEmbeddings().embed([c for c, _ in CHUNKS])
+    index = faiss.IndexFlatIP(vecs.shape[1])
+    index.add(vecs)
+    faiss.write_index(index, os.path.join(faiss_dir, "index.faiss"))
+    # rows without ids, as written before the manifest existed: FAISS ids are positions
+    with open(os.path.join(faiss_dir, "store.jsonl"), "w", encoding="utf-8") as f:
+        for chunk, source in CHUNKS:
+            f.write(json.dumps({"chunk": chunk, "source": source}) + "\n")
+
+
+def check(ok: bool, what: str) -> bool:
+    print(("✓ " if ok else "✗ ") + what)
+    return ok
+
+
+def main():
+    write_legacy_layout(os.path.join("models", "faiss"))
+    import app
+
+    result = app.rag_search("kmeans centroid", k=2)
+    print("=" * 60)
+    results = [
+        check("clustering.md" in result, "rag_search serves the pre-upgrade index"),
+        check(os.path.exists(app.FAISS_STORE) and not os.path.exists(app.FAISS_STORE_JSONL),
+              "store.jsonl converted to the chunk store"),
+    ]
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
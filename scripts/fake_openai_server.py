@@ -0,0 +1,233 @@
+"""
+Local stand-in for the OpenAI HTTP API, for offline checks and benchmarks.
+
+Serves deterministic embeddings (hashed bag-of-words) with configurable
+latency, per-request input limits and injected 429 rate-limit responses, and
+canned chat completions (optionally streamed): when tools are offered and no
+tool result is in the conversation yet it answers with a `rag_lookup` call,
+evaluator prompts get a passing score, and everything else gets a short
+deterministic reply.
+
+Run standalone:
+    python scripts/fake_openai_server.py --port 8765 --latency 0.05
+then point the app at it:
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake python app.py
+"""
+import argparse, hashlib, json, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fake_embedding(text: str, dim: int) -> list:
+    """Deterministic unit vector: hashed bag of lowercase words."""
+    v = np.zeros(dim, dtype="float32")
+    for tok in TOKEN_RE.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(tok.encode("utf-8"), digest_size=8).digest(), "little")
+        v[h % dim] += 1.0 if (h >> 63) == 0 else -1.0
+    n = float(np.linalg.norm(v))
+    if n == 0:
+        v[0] = 1.0
+        n = 1.0
+    return (v / n).tolist()
+
+
+def _usage(messages: list, content) -> dict:
+    prompt = sum(len(m.get("content") or "") for m in messages) // 4
+    completion = len(content or "") // 4
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connects in a burst of concurrent clients,
+    # and the client's SYN retry adds a second to those requests
+    request_queue_size = 128
+
+    def __init__(self, addr, latency=0.0, dim=256, max_items=2048, rate_limit_every=0,
+                 tool_calls=True, stream_delay=0.0):
+        super().__init__(addr, _Handler)
+        self.latency = latency
+        self.tool_calls = tool_calls
+        self.stream_delay = stream_delay
+        self.dim = dim
+        self.max_items = max_items
+        self.rate_limit_every = rate_limit_every
+        self.lock = threading.Lock()
+        self.stats = {"embedding_requests": 0, "embedded_inputs": 0, "rate_limited": 0,
+                      "chat_requests": 0, "in_flight": 0, "max_in_flight": 0}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _enter(self):
+        with self.lock:
+            self.stats["in_flight"] += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+    def _leave(self):
+        with self.lock:
+            self.stats["in_flight"] -= 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: dict, headers: dict = None):
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _read_json(self) -> dict:
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}")
+
+    def do_POST(self):
+        srv = self.server
+        payload = self._read_json()
+        srv._enter()
+        try:
+            if srv.latency:
+                time.sleep(srv.latency)
+            if self.path.rstrip("/").endswith("/embeddings"):
+                self._embeddings(payload)
+            elif self.path.rstrip("/").endswith("/chat/completions"):
+                self._chat(payload)
+            else:
+                self._send(404, {"error": {"message": f"unknown route {self.path}"}})
+        finally:
+            srv._leave()
+
+    def _embeddings(self, payload: dict):
+        srv = self.server
+        inputs = payload.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        with srv.lock:
+            srv.stats["embedding_requests"] += 1
+            n = srv.stats["embedding_requests"]
+            limited = bool(srv.rate_limit_every) and n % srv.rate_limit_every == 0
+            if limited:
+                srv.stats["rate_limited"] += 1
+        if limited:
+            self._send(429, {"error": {"message": "Rate limit reached (fake)", "type": "requests"}},
+                       {"retry-after": "0.05"})
+            return
+        if len(inputs) > srv.max_items:
+            self._send(400, {"error": {"message": f"too many inputs: {len(inputs)} > {srv.max_items}"}})
+            return
+        with srv.lock:
+            srv.stats["embedded_inputs"] += len(inputs)
+        data = [{"object": "embedding", "index": i, "embedding": fake_embedding(t, srv.dim)}
+                for i, t in enumerate(inputs)]
+        self._send(200, {
+            "object": "list",
+            "data": data,
+            "model": payload.get("model", "fake"),
+            "usage": {"prompt_tokens": sum(len(t) // 4 + 1 for t in inputs),
+                      "total_tokens": sum(len(t) // 4 + 1 for t in inputs)},
+        })
+
+    def _chat(self, payload: dict):
+        srv = self.server
+        with srv.lock:
+            srv.stats["chat_requests"] += 1
+        messages = payload.get("messages", [])
+        system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+        last_user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        has_tool_result = any(m.get("role") == "tool" for m in messages)
+
+        tool_call, content = None, None
+        if payload.get("tools") and srv.tool_calls and not has_tool_result:
+            tool_call = {"id": f"call_{srv.stats['chat_requests']}", "type": "function",
+                         "function": {"name": "rag_lookup",
+                                      "arguments": json.dumps({"query": last_user[:200], "k": 4})}}
+        elif "evaluator" in system.lower():
+            content = json.dumps({"helpfulness": 5, "faithfulness": 5, "style": 5,
+                                  "feedback": "clear, helpful and faithful"})
+        else:
+            words = re.findall(r"\w+", last_user)[:12]
+            content = "Thanks for asking! In short: " + " ".join(words) + "."
+
+        if payload.get("stream"):
+            self._chat_stream(payload, tool_call, content)
+            return
+        message = {"role": "assistant", "content": content}
+        if tool_call:
+            message["tool_calls"] = [tool_call]
+        self._send(200, {
+            "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+            "model": payload.get("model", "fake"),
+            "choices": [{"index": 0, "message": message,
+                         "finish_reason": "tool_calls" if tool_call else "stop"}],
+            "usage": _usage(messages, content),
+        })
+
+    def _chat_stream(self, payload: dict, tool_call, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def emit(delta, finish_reason=None):
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": payload.get("model", "fake"),
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        emit({"role": "assistant", "content": ""})
+        if tool_call:
+            args = tool_call["function"]["arguments"]
+            emit({"tool_calls": [{"index": 0, "id": tool_call["id"], "type": "function",
+                                  "function": {"name": tool_call["function"]["name"], "arguments": ""}}]})
+            for i in range(0, len(args), 16):
+                emit({"tool_calls": [{"index": 0, "function": {"arguments": args[i:i + 16]}}]})
+            emit({}, "tool_calls")
+        else:
+            for piece in re.findall(r"\S+\s*", content):
+                if self.server.stream_delay:
+                    time.sleep(self.server.stream_delay)
+                emit({"content": piece})
+            emit({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(port: int = 0, **opts) -> FakeOpenAIServer:
+    """Start the fake server on a background thread; use .base_url and .shutdown()."""
+    srv = FakeOpenAIServer(("127.0.0.1", port), **opts)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--max-items", type=int, default=2048)
+    ap.add_argument("--rate-limit-every", type=int, default=0, help="return 429 on every Nth embeddings request")
+    ap.add_argument("--no-tool-calls", action="store_true", help="never answer with a rag_lookup tool call")
+    ap.add_argument("--stream-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    args = ap.parse_args()
+    srv = FakeOpenAIServer(("127.0.0.1", args.port), latency=args.latency, dim=args.dim,
+                           max_items=args.max_items, rate_limit_every=args.rate_limit_every,
+                           tool_calls=not args.no_tool_calls, stream_delay=args.stream_delay)
+    print(f"Fake OpenAI API listening on {srv.base_url}", flush=True)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,16 @@
+"""
+Create the QADB schema ahead of time (the app also does this once at startup).
+
+    python scripts/init_qadb.py [path]    # default: data/qadb.sqlite
+"""
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from qadb import QADBStore
+
+path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(ROOT, "data", "qadb.sqlite")
+store = QADBStore(path)
+(count,) = store._reader().execute("SELECT COUNT(*) FROM qa").fetchone()
+print(f"QADB ready at {path} ({count} rows)")
@@ -0,0 +1,88 @@
+"""
+Synthetic knowledge base for benchmarks: markdown "course notes" with a
+predictable number of chunks.
+
+Every file is a run of `## ...` sections whose body stays under the splitter's
+1200 characters, so a file of S sections gives S chunks (see app._split_md).
+Words come from a few topic vocabularies, so queries about a topic have
+lexical and (fake-embedding) vector matches; a fraction of the sections are
+copies of earlier ones with a word or two changed, for the near-duplicate
+detection to find.
+
+    python scripts/synth_kb.py OUT_DIR --chunks 5000 [--sections 8] [--dup-rate 0.05] [--seed 0]
+"""
+import argparse, os, random
+from typing import List
+
+TOPICS = {
+    "clustering": "kmeans centroid cluster silhouette dbscan hierarchical linkage elbow inertia density",
+    "regression": "ridge lasso coefficient residual least squares regularization bias variance intercept",
+    "databases": "sql index join transaction normalization query schema btree sqlite postgres",
+    "nlp": "token embedding transformer attention corpus vocabulary bigram perplexity lemma stopword",
+    "statistics": "probability distribution hypothesis pvalue confidence interval bayes prior posterior sample",
+    "dama": "governance metadata quality stewardship lineage catalog master reference lifecycle policy",
+}
+FILLER = ("the a of and to in we is for this with that on by as are it from be an results "
+          "assignment homework project notebook method data model figure table section").split()
+
+
+def section(rng: random.Random, topic: str, n_words: int) -> str:
+    vocab = TOPICS[topic].split()
+    words = [rng.choice(vocab) if rng.random() < 0.35 else rng.choice(FILLER) for _ in range(n_words)]
+    lines = [" ".join(words[i:i + 14]) for i in range(0, len(words), 14)]
+    return "\n".join(lines)
+
+
+def mutate(rng: random.Random, text: str) -> str:
+    words = text.split(" ")
+    for _ in range(2):
+        words[rng.randrange(len(words))] = rng.choice(FILLER)
+    return " ".join(words)
+
+
+def generate(out_dir: str, chunks: int, sections: int = 8, dup_rate: float = 0.05, seed: int = 0) -> List[str]:
+    """Write about `chunks` chunks of markdown under out_dir; returns the file paths."""
+    rng = random.Random(seed)
+    topics = sorted(TOPICS)
+    paths, bodies = [], []
+    n_files = max(1, -(-chunks // sections))
+    for f in range(n_files):
+        topic = topics[f % len(topics)]
+        folder = os.path.join(out_dir, f"course{f % 12:02d}")
+        os.makedirs(folder, exist_ok=True)
+        parts = []
+        for s in range(min(sections, chunks - f * sections)):
+            if bodies and rng.random() < dup_rate:
+                body = mutate(rng, rng.choice(bodies))
+            else:
+                body = section(rng, topic, rng.randint(80, 130))
+                bodies.append(body)
+            parts.append(f"{body}\n## {topic} part {s + 1}\n")
+        path = os.path.join(folder, f"{topic}_{f:05d}.md")
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write("".join(parts))
+        paths.append(path)
+    return paths
+
+
+def queries(n: int, seed: int = 1) -> List[str]:
+    """n natural-language-ish queries over the synthetic topics (all distinct)."""
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        topic = rng.choice(sorted(TOPICS))
+        terms = rng.sample(TOPICS[topic].split(), 3)
+        out.append(f"what did the {topic} homework say about {' '.join(terms)} ({i})")
+    return out
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("out_dir")
+    ap.add_argument("--chunks", type=int, default=1000)
+    ap.add_argument("--sections", type=int, default=8, help="sections (= chunks) per file")
+    ap.add_argument("--dup-rate", type=float, default=0.05)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    files = generate(args.out_dir, args.chunks, args.sections, args.dup_rate, args.seed)
+    print(f"Wrote {len(files)} files (~{args.chunks} chunks) under {args.out_dir}")
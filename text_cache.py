@@ -0,0 +1,99 @@
+"""Cache of extracted KB file text: in-memory LRU in front of SQLite.
+
+Entries are keyed by absolute path and only valid for the file's current
+mtime and size, so an edited file is re-extracted on its next read. Text is
+stored zlib-compressed; one row per path, replaced when the file changes.
+Shared by KB ingestion and the per-request assignment loading in app.py.
+"""
+import os, sqlite3, threading, zlib
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+TEXT_CACHE_PATH = os.getenv("TEXT_CACHE_PATH", "data/text_cache.sqlite")
+TEXT_CACHE_MEM_CHARS = int(os.getenv("TEXT_CACHE_MEM_CHARS", str(16_000_000)))
+
+
+def file_key(fp: str) -> Tuple[str, int, int]:
+    """(absolute path, mtime_ns, size) for fp; raises OSError if it is gone."""
+    st = os.stat(fp)
+    return os.path.abspath(fp), st.st_mtime_ns, st.st_size
+
+
+class TextCache:
+    def __init__(self, path: Optional[str] = TEXT_CACHE_PATH, mem_chars: int = TEXT_CACHE_MEM_CHARS):
+        self.mem_chars = mem_chars
+        self._mem: "OrderedDict[tuple, Tuple[str, int]]" = OrderedDict()
+        self._mem_size = 0
+        self._lock = threading.Lock()
+        self._con = None
+        self.stats = {"mem_hits": 0, "disk_hits": 0, "misses": 0}
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._con = sqlite3.connect(path, check_same_thread=False)
+                self._con.execute("PRAGMA journal_mode=WAL;")
+                self._con.execute("PRAGMA synchronous=NORMAL;")
+                self._con.execute("""
+                CREATE TABLE IF NOT EXISTS text(
+                  path TEXT PRIMARY KEY,
+                  mtime INTEGER NOT NULL,
+                  size INTEGER NOT NULL,
+                  pages INTEGER NOT NULL,
+                  body BLOB NOT NULL
+                );""")
+                self._con.commit()
+            except sqlite3.Error as e:
+                print(f"[KB] Text cache unavailable ({path}): {e}", flush=True)
+                self._con = None
+
+    def _mem_put(self, key: tuple, value: Tuple[str, int]):
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_size -= len(old[0])
+        if len(value[0]) > self.mem_chars:
+            return
+        self._mem[key] = value
+        self._mem_size += len(value[0])
+        while self._mem_size > self.mem_chars:
+            _, (text, _) = self._mem.popitem(last=False)
+            self._mem_size -= len(text)
+
+    def get(self, key: Tuple[str, int, int]) -> Optional[Tuple[str, int]]:
+        """(text, pages) extracted from this exact file version, or None."""
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                self._mem.move_to_end(key)
+                self.stats["mem_hits"] += 1
+                return hit
+            if self._con is not None:
+                row = self._con.execute(
+                    "SELECT pages, body FROM text WHERE path = ? AND mtime = ? AND size = ?", key).fetchone()
+                if row is not None:
+                    hit = (zlib.decompress(row[1]).decode("utf-8"), row[0])
+                    self._mem_put(key, hit)
+                    self.stats["disk_hits"] += 1
+                    return hit
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: Tuple[str, int, int], text: str, pages: int = 0):
+        with self._lock:
+            self._mem_put(key, (text, pages))
+            if self._con is not None:
+                self._con.execute("INSERT OR REPLACE INTO text(path, mtime, size, pages, body) VALUES (?,?,?,?,?)",
+                                  (*key, pages, zlib.compress(text.encode("utf-8"), 6)))
+                self._con.commit()
+
+    def hit_rate(self) -> float:
+        hits = self.stats["mem_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            self._mem_size = 0
+            if self._con is not None:
+                self._con.execute("DELETE FROM text")
+                self._con.commit()
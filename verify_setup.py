@@ -67,9 +67,10 @@ else:
 # Check 5: FAISS index
 print("\n[5] Checking FAISS index...")
 faiss_index = os.path.join(os.path.dirname(__file__), "models", "faiss", "index.faiss")
-faiss_store = os.path.join(os.path.dirname(__file__), "models", "faiss", "store.jsonl")
+faiss_store = os.path.join(os.path.dirname(__file__), "models", "faiss", "chunks.bin")
+legacy_store = os.path.join(os.path.dirname(__file__), "models", "faiss", "store.jsonl")
 
-if os.path.exists(faiss_index) and os.path.exists(faiss_store):
+if os.path.exists(faiss_index) and (os.path.exists(faiss_store) or os.path.exists(legacy_store)):
     print("✓ FAISS index exists")
     # Try to read it
     try: